@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# Модули проекта лежат в src/ и в корне (wb_monitor) - добавляем пути один раз на весь прогон pytest
+sys.path.insert(0, str(Path(__file__).parent / 'src'))
+sys.path.insert(0, str(Path(__file__).parent))
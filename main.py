@@ -35,8 +35,10 @@ shutdown_event = asyncio.Event()
 class WBTelegramService:
     """Основной сервис, объединяющий мониторинг WB и Telegram бота"""
     
-    def __init__(self, update_interval: int = 300):
+    def __init__(self, update_interval: int = 300, sheet_cache_ttl: int = 0, quiet: bool = False):
         self.update_interval = update_interval
+        self.sheet_cache_ttl = sheet_cache_ttl
+        self.quiet = quiet
         self.telegram_notifier: Optional = None
         self.wb_monitor: Optional[WBSlotsMonitor] = None
         self.running = False
@@ -57,7 +59,9 @@ class WBTelegramService:
             logger.info("📊 Создание WB монитора...")
             self.wb_monitor = WBSlotsMonitor(
                 update_interval=self.update_interval,
-                telegram_notifier=self.telegram_notifier
+                telegram_notifier=self.telegram_notifier,
+                sheet_cache_ttl=self.sheet_cache_ttl,
+                quiet=self.quiet
             )
             
             logger.info("✅ Инициализация завершена успешно")
@@ -70,8 +74,17 @@ class WBTelegramService:
         """Запускает Telegram бота с graceful shutdown"""
         try:
             logger.info("🤖 Запуск Telegram бота...")
+            # В продакшене используем webhook, если задан его адрес, иначе long polling
+            webhook_url = os.getenv('TELEGRAM_WEBHOOK_URL')
+            if webhook_url:
+                webhook_port = int(os.getenv('TELEGRAM_WEBHOOK_PORT', '8080'))
+                webhook_secret = os.getenv('TELEGRAM_WEBHOOK_SECRET')
+                bot_coro = self.telegram_notifier.start_webhook(webhook_url, webhook_port, webhook_secret)
+            else:
+                bot_coro = self.telegram_notifier.start_bot()
+            
             # Создаем задачу для бота
-            bot_polling_task = asyncio.create_task(self.telegram_notifier.start_bot())
+            bot_polling_task = asyncio.create_task(bot_coro)
             
             # Ждем либо завершения бота, либо сигнала остановки
             done, pending = await asyncio.wait(
@@ -206,6 +219,10 @@ async def main():
     parser = argparse.ArgumentParser(description='WB Slots Monitor с Telegram ботом')
     parser.add_argument('--interval', '-i', type=int, default=300,
                        help='Интервал мониторинга в секундах (по умолчанию: 300)')
+    parser.add_argument('--sheet-cache-ttl', type=int, default=0,
+                       help='Сколько секунд переиспользовать парсинг неизмененной таблицы (по умолчанию: 0 - выключено)')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                       help='Не выводить подробный отчет по слотам в консоль, только сводку')
     
     args = parser.parse_args()
     
@@ -213,7 +230,7 @@ async def main():
     setup_signal_handlers()
     
     # Создаем сервис
-    service = WBTelegramService(update_interval=args.interval)
+    service = WBTelegramService(update_interval=args.interval, sheet_cache_ttl=args.sheet_cache_ttl, quiet=args.quiet)
     
     try:
         # Запускаем сервис
@@ -0,0 +1,7 @@
+# Флаг опции приемки WB -> тип упаковки в слотах (box_type) и его значок.
+# Общая таблица для консольного отчета и сообщений Telegram
+PACKAGING_EMOJI = (
+    ('canBox', 'Короба', '📦'),
+    ('canMonopallet', 'Монопаллеты', '🚛'),
+    ('canSupersafe', 'Суперсейф', '🔒'),
+)
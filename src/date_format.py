@@ -0,0 +1,24 @@
+from datetime import datetime
+from functools import lru_cache
+
+# Формат дат в выводе: "ДД.ММ ЧЧ:ММ"
+_DATE_FMT_OUT = '%d.%m %H:%M'
+
+
+@lru_cache(maxsize=4096)
+def format_dt(dt_str: str) -> str:
+    """
+    Форматирует ISO дату (слоты WB, время парсинга) для вывода в консоль и Telegram
+
+    Даты в выдаче часто повторяются, поэтому результат кешируется.
+    Строки, которые не удалось разобрать, возвращаются как есть.
+    """
+    # Обычный ISO формат (YYYY-MM-DDTHH:MM...) раскладываем срезами без разбора в datetime
+    if (dt_str and len(dt_str) >= 16 and dt_str[4] == dt_str[7] == '-' and dt_str[10] == 'T' and dt_str[13] == ':'
+            and (dt_str[:4] + dt_str[5:7] + dt_str[8:10] + dt_str[11:13] + dt_str[14:16]).isdigit()):
+        return f"{dt_str[8:10]}.{dt_str[5:7]} {dt_str[11:13]}:{dt_str[14:16]}"
+    # fromisoformat до Python 3.11 не понимает суффикс Z
+    try:
+        return datetime.fromisoformat(dt_str.replace('Z', '+00:00')).strftime(_DATE_FMT_OUT)
+    except (ValueError, TypeError, AttributeError):
+        return dt_str
@@ -32,6 +32,8 @@ class GoogleSheetsParser:
         self.client = None
         self.spreadsheet = None
         self.current_worksheet = None
+        self._worksheets = {}  # Листы, полученные последним get_available_sheets: {название: Worksheet}
+        self.failed_sheets = []  # Листы, которые не удалось распарсить при последнем parse_all_sheets
         self.api_requests_count = 0  # Счетчик API запросов
         self._setup_logger()
         
@@ -82,7 +84,9 @@ class GoogleSheetsParser:
             if not self.spreadsheet:
                 self.connect_to_spreadsheet()
                 
-            self.current_worksheet = self.spreadsheet.worksheet(sheet_name)
+            # Объект листа уже получен вместе со списком листов - не запрашиваем метаданные повторно
+            worksheet = self._worksheets.get(sheet_name)
+            self.current_worksheet = worksheet if worksheet is not None else self.spreadsheet.worksheet(sheet_name)
         except gspread.exceptions.WorksheetNotFound:
             available_sheets = [ws.title for ws in self.spreadsheet.worksheets()]
             error_msg = f"Лист '{sheet_name}' не найден. Доступные листы: {available_sheets}"
@@ -204,12 +208,20 @@ class GoogleSheetsParser:
             
         return products
         
+    def get_revision(self) -> str:
+        """Возвращает время последнего изменения таблицы (Drive modifiedTime) - один легкий запрос"""
+        if not self.spreadsheet:
+            self.connect_to_spreadsheet()
+        
+        return self._retry_with_backoff(self.spreadsheet.get_lastUpdateTime)
+        
     def get_available_sheets(self) -> List[str]:
         if not self.spreadsheet:
             self.connect_to_spreadsheet()
         
         self.api_requests_count += 1  # Запрос списка листов
-        return [ws.title for ws in self.spreadsheet.worksheets()]
+        self._worksheets = {ws.title: ws for ws in self.spreadsheet.worksheets()}
+        return list(self._worksheets)
         
     def _parse_sheet_data(self, sheet_name: str) -> SheetsData:
         self._set_worksheet(sheet_name)
@@ -227,6 +239,7 @@ class GoogleSheetsParser:
         
     def parse_all_sheets(self) -> Dict[str, SheetsData]:
         self.api_requests_count = 0  # Сбрасываем счетчик в начале парсинга
+        self.failed_sheets = []
         available_sheets = self.get_available_sheets()
         results = {}
         
@@ -237,6 +250,7 @@ class GoogleSheetsParser:
                 results[sheet_name] = data
             except Exception as e:
                 error_msg = f"Ошибка при парсинге листа '{sheet_name}': {e} | API запросов выполнено: {self.api_requests_count}"
+                self.failed_sheets.append(sheet_name)
                 print(error_msg)
                 self.logger.error(error_msg)
                 
@@ -1,22 +1,159 @@
+import asyncio
 import requests
-import json
+import aiohttp
+import orjson
 import os
+import random
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Dict, Optional, Any
+from operator import itemgetter
+from typing import List, Dict, Optional, Any, Tuple
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
+# Повторы асинхронных запросов при 429/5xx и сетевых ошибках
+_RETRY_ATTEMPTS = 5
+_RETRY_BACKOFF = 1.0  # секунды, удваивается с каждой попыткой
+_RETRY_JITTER = 0.2
+
+# Заголовки лимитов WB, которые запоминаются для расчета пауз между циклами
+_RATE_LIMIT_HEADERS = ('X-Ratelimit-Remaining', 'X-Ratelimit-Reset', 'X-Ratelimit-Retry', 'Retry-After')
+
+
+@dataclass(frozen=True)
+class CompiledProducts:
+    """Товары всех листов, подготовленные для запроса опций один раз на парсинг, а не на каждый API цикл"""
+    products: Tuple[Dict[str, Any], ...]  # Уникальные пары (баркод, количество)
+    product_to_sheet_map: Dict[str, List[str]]  # Баркод -> названия листов
+    options_body: bytes  # Готовое тело POST запроса опций
+
+
+class WBRateLimiter:
+    """
+    Ограничитель запросов к WB API по заголовкам ответов
+    
+    У каждого endpoint'а WB свой лимит. Когда ответ сообщает, что лимит исчерпан
+    (X-Ratelimit-Remaining: 0) или приходит 429, следующие запросы к этому endpoint'у
+    ждут до сброса лимита вместо того, чтобы получать отказ.
+    """
+    
+    def __init__(self):
+        self._ready_at: Dict[str, float] = {}  # endpoint -> time.monotonic(), раньше которого запрос не отправляем
+        self.last_headers: Dict[str, Dict[str, str]] = {}  # endpoint -> заголовки лимитов последнего ответа
+    
+    async def wait(self, endpoint: str):
+        """Ждет, пока endpoint снова станет доступен"""
+        delay = self._ready_at.get(endpoint, 0) - time.monotonic()
+        if delay > 0:
+            print(f"⏳ Лимит WB API для {endpoint}: ждем {delay:.1f}с")
+            await asyncio.sleep(delay)
+    
+    def update(self, endpoint: str, status: int, headers) -> float:
+        """
+        Учитывает заголовки ответа
+        
+        Returns:
+            Сколько секунд endpoint будет недоступен (0 - можно продолжать)
+        """
+        self.last_headers[endpoint] = {name: headers[name] for name in _RATE_LIMIT_HEADERS if name in headers}
+        
+        delay = 0.0
+        try:
+            if status == 429:
+                delay = float(headers.get('X-Ratelimit-Retry') or headers.get('Retry-After') or 0)
+            elif headers.get('X-Ratelimit-Remaining') == '0':
+                delay = float(headers.get('X-Ratelimit-Reset') or 0)
+        except ValueError:
+            delay = 0.0
+        
+        if delay > 0:
+            self._ready_at[endpoint] = max(self._ready_at.get(endpoint, 0), time.monotonic() + delay)
+        return delay
+
 
 class WildBerriesAPI:
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, limiter: Optional[WBRateLimiter] = None):
         self.api_key = api_key or os.getenv('WB_API_KEY')
+        self.limiter = limiter or WBRateLimiter()
         self.base_url = 'https://supplies-api.wildberries.ru'
         self.headers = {
             'Authorization': self.api_key,
             'Content-Type': 'application/json'
         }
+        
+        # Общая сессия: keep-alive соединение к supplies-api переиспользуется между запросами
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        
+        # Асинхронная сессия создается лениво: ей нужен работающий event loop
+        self._async_session: Optional[aiohttp.ClientSession] = None
+    
+    def _get_async_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую aiohttp сессию, создавая ее при первом обращении"""
+        if self._async_session is None or self._async_session.closed:
+            self._async_session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=30),
+                connector=aiohttp.TCPConnector(limit=64, limit_per_host=64)
+            )
+        return self._async_session
+    
+    async def close(self):
+        """Закрывает асинхронную HTTP сессию"""
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+        self._async_session = None
+    
+    async def _request_async(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
+        """
+        Выполняет асинхронный запрос к WB API с учетом лимитов и повторами
+        при 429/5xx и сетевых ошибках (экспоненциальная пауза с jitter)
+        
+        Returns:
+            Dict содержащий success, data, error
+        """
+        endpoint = url.split('?', 1)[0]
+        error = None
+        
+        for attempt in range(_RETRY_ATTEMPTS):
+            await self.limiter.wait(endpoint)
+            limit_delay = 0.0
+            
+            try:
+                async with self._get_async_session().request(method, url, **kwargs) as response:
+                    limit_delay = self.limiter.update(endpoint, response.status, response.headers)
+                    
+                    if response.status == 200:
+                        return {
+                            'success': True,
+                            'data': orjson.loads(await response.read()),
+                            'error': None
+                        }
+                    
+                    error = f"HTTP {response.status}: {await response.text()}"
+                    if response.status != 429 and response.status < 500:
+                        break
+                        
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            except Exception as e:
+                error = str(e)
+                break
+            
+            # При 429 пауза уже выставлена лимитером, иначе - экспоненциальная
+            if attempt + 1 < _RETRY_ATTEMPTS and not limit_delay:
+                await asyncio.sleep(_RETRY_BACKOFF * 2 ** attempt * (1 + random.uniform(0, _RETRY_JITTER)))
+        
+        return {
+            'success': False,
+            'data': None,
+            'error': error
+        }
     
     def get_warehouses(self) -> Dict[str, Any]:
         """
@@ -28,12 +165,12 @@ class WildBerriesAPI:
         url = f"{self.base_url}/api/v1/warehouses"
         
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self.session.get(url)
             
             if response.status_code == 200:
                 return {
                     'success': True,
-                    'data': response.json(),
+                    'data': orjson.loads(response.content),
                     'error': None
                 }
             else:
@@ -60,12 +197,12 @@ class WildBerriesAPI:
         url = f"{self.base_url}/api/v1/acceptance/coefficients"
         
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self.session.get(url)
             
             if response.status_code == 200:
                 return {
                     'success': True,
-                    'data': response.json(),
+                    'data': orjson.loads(response.content),
                     'error': None
                 }
             else:
@@ -99,12 +236,13 @@ class WildBerriesAPI:
             url += f"?warehouseID={warehouse_id}"
         
         try:
-            response = requests.post(url, headers=self.headers, json=products)
+            # Content-Type: application/json уже задан в заголовках сессии
+            response = self.session.post(url, data=orjson.dumps(products))
             
             if response.status_code == 200:
                 return {
                     'success': True,
-                    'data': response.json(),
+                    'data': orjson.loads(response.content),
                     'error': None
                 }
             else:
@@ -121,22 +259,48 @@ class WildBerriesAPI:
                 'error': str(e)
             }
     
-    def find_warehouse_ids_by_names(self, warehouse_names: List[str]) -> Dict[str, Optional[int]]:
+    async def get_warehouses_async(self) -> Dict[str, Any]:
+        """Асинхронный вариант get_warehouses"""
+        return await self._request_async('GET', f"{self.base_url}/api/v1/warehouses")
+    
+    async def get_acceptance_coefficients_async(self) -> Dict[str, Any]:
+        """Асинхронный вариант get_acceptance_coefficients"""
+        return await self._request_async('GET', f"{self.base_url}/api/v1/acceptance/coefficients")
+    
+    async def get_acceptance_options_async(self, products: List[Dict[str, Any]], warehouse_id: Optional[str] = None,
+                                           body: Optional[bytes] = None) -> Dict[str, Any]:
+        """
+        Асинхронный вариант get_acceptance_options
+        
+        body - уже сериализованный список products (см. CompiledProducts), чтобы не кодировать его заново
+        """
+        url = f"{self.base_url}/api/v1/acceptance/options"
+        
+        if warehouse_id:
+            url += f"?warehouseID={warehouse_id}"
+        
+        return await self._request_async('POST', url, data=body if body is not None else orjson.dumps(products))
+    
+    def find_warehouse_ids_by_names(self, warehouse_names: List[str],
+                                    warehouses: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Optional[int]]:
         """
         Находит ID складов по их названиям
         
         Args:
             warehouse_names: Список названий складов
+            warehouses: Уже полученный список складов (если None - запрашивается)
             
         Returns:
             Dict {название_склада: ID_склада или None}
         """
-        warehouses_result = self.get_warehouses()
-        
-        if not warehouses_result['success']:
-            return {name: None for name in warehouse_names}
+        if warehouses is None:
+            warehouses_result = self.get_warehouses()
+            
+            if not warehouses_result['success']:
+                return {name: None for name in warehouse_names}
+            
+            warehouses = warehouses_result['data']
         
-        warehouses = warehouses_result['data']
         name_to_id = {}
         
         for warehouse in warehouses:
@@ -148,16 +312,129 @@ class WildBerriesAPI:
         
         return result
     
-    def check_available_slots_optimized(self, all_sheets_data: Dict[str, Any]) -> Dict[str, Any]:
+    def check_available_slots_optimized(self, all_sheets_data: Dict[str, Any],
+                                        warehouses: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """
         Оптимизированная проверка слотов для всех листов одновременно
         
         Args:
             all_sheets_data: Все данные из parsed_data.json
+            warehouses: Уже полученный список складов (если None - запрашивается)
+            
+        Returns:
+            Dict с результатами мониторинга для всех листов
+        """
+        sheets = all_sheets_data.get('sheets', {})
+        all_products, product_to_sheet_map = self._collect_products(sheets)
+        
+        # 1. Получаем список складов (1 запрос, если он не передан)
+        if warehouses is not None:
+            warehouses_result = {'success': True, 'data': warehouses, 'error': None}
+            print("📋 Используем ранее полученный список складов")
+        else:
+            print("📋 Запрос списка складов...")
+            warehouses_result = self.get_warehouses()
+        
+        if not warehouses_result['success']:
+            return self._build_slots_result(sheets, product_to_sheet_map, warehouses_result, None, None)
+        
+        # 2. Получаем коэффициенты приемки (1 запрос)
+        print("📊 Запрос коэффициентов приемки...")
+        coefficients_result = self.get_acceptance_coefficients()
+        
+        # 3. Получаем опции для всех товаров одним запросом (1 запрос)
+        options_result = None
+        if all_products:
+            print(f"📦 Запрос опций для {len(all_products)} товаров...")
+            options_result = self.get_acceptance_options(all_products)
+        
+        return self._build_slots_result(sheets, product_to_sheet_map, warehouses_result,
+                                        coefficients_result, options_result)
+    
+    async def check_available_slots_optimized_async(self, all_sheets_data: Dict[str, Any],
+                                                    warehouses: Optional[List[Dict[str, Any]]] = None,
+                                                    compiled: Optional[CompiledProducts] = None) -> Dict[str, Any]:
+        """
+        Асинхронный вариант check_available_slots_optimized: запросы складов,
+        коэффициентов и опций независимы и выполняются параллельно
+        
+        Args:
+            all_sheets_data: Все данные из parsed_data.json
+            warehouses: Уже полученный список складов (если None - запрашивается)
+            compiled: Товары, заранее подготовленные compile_products для этих же данных
             
         Returns:
             Dict с результатами мониторинга для всех листов
         """
+        sheets = all_sheets_data.get('sheets', {})
+        if compiled is None:
+            compiled = self.compile_products(sheets)
+        
+        requests_by_name = {'coefficients': self.get_acceptance_coefficients_async()}
+        if warehouses is None:
+            requests_by_name['warehouses'] = self.get_warehouses_async()
+        if compiled.products:
+            requests_by_name['options'] = self.get_acceptance_options_async(
+                compiled.products, body=compiled.options_body
+            )
+        
+        print(f"🌐 Параллельный запрос к WB API ({len(requests_by_name)} запроса, товаров: {len(compiled.products)})...")
+        responses = dict(zip(requests_by_name, await asyncio.gather(*requests_by_name.values())))
+        
+        warehouses_result = responses.get('warehouses') or {'success': True, 'data': warehouses, 'error': None}
+        return self._build_slots_result(sheets, compiled.product_to_sheet_map, warehouses_result,
+                                        responses['coefficients'], responses.get('options'))
+    
+    def compile_products(self, sheets: Dict[str, Any]) -> CompiledProducts:
+        """Собирает товары листов и сразу сериализует тело запроса опций"""
+        all_products, product_to_sheet_map = self._collect_products(sheets)
+        return CompiledProducts(
+            products=tuple(all_products),
+            product_to_sheet_map=product_to_sheet_map,
+            options_body=orjson.dumps(all_products)
+        )
+    
+    def _collect_products(self, sheets: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, List[str]]]:
+        """
+        Собирает товары всех листов для одного запроса опций
+        
+        Одинаковые пары (баркод, количество) из разных листов запрашиваются один раз:
+        опции зависят только от них, а листы потом берут свои опции по баркоду.
+        
+        Returns:
+            (уникальные товары, маппинг баркод -> названия листов)
+        """
+        all_products = []
+        requested = set()
+        product_to_sheet_map = {}  # Маппинг баркод -> название листа
+        
+        for sheet_name, sheet_data in sheets.items():
+            products = sheet_data.get('products', [])
+            for product in products:
+                barcode = product['barcode']
+                product_key = (barcode, product['quantity'])
+                if product_key not in requested:
+                    requested.add(product_key)
+                    all_products.append(product)
+                if barcode not in product_to_sheet_map:
+                    product_to_sheet_map[barcode] = []
+                product_to_sheet_map[barcode].append(sheet_name)
+        
+        return all_products, product_to_sheet_map
+    
+    def _build_slots_result(self, sheets: Dict[str, Any], product_to_sheet_map: Dict[str, List[str]],
+                            warehouses_result: Dict[str, Any], coefficients_result: Optional[Dict[str, Any]],
+                            options_result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Собирает результаты мониторинга из ответов API
+        
+        Args:
+            sheets: Данные листов
+            product_to_sheet_map: Маппинг баркод -> названия листов
+            warehouses_result: Ответ со списком складов
+            coefficients_result: Ответ с коэффициентами (None - не запрашивались)
+            options_result: Ответ с опциями (None - нет товаров)
+        """
         result = {
             'timestamp': datetime.now().isoformat(),
             'sheets': {},
@@ -169,11 +446,6 @@ class WildBerriesAPI:
             'errors': []
         }
         
-        sheets = all_sheets_data.get('sheets', {})
-        
-        # 1. Получаем список складов (1 запрос)
-        print("📋 Запрос списка складов...")
-        warehouses_result = self.get_warehouses()
         if warehouses_result['success']:
             result['global_data']['warehouses'] = warehouses_result['data']
             print(f"✅ Получено {len(warehouses_result['data'])} складов")
@@ -182,9 +454,6 @@ class WildBerriesAPI:
             print(f"❌ Ошибка складов: {warehouses_result['error']}")
             return result
         
-        # 2. Получаем коэффициенты приемки (1 запрос)
-        print("📊 Запрос коэффициентов приемки...")
-        coefficients_result = self.get_acceptance_coefficients()
         if coefficients_result['success']:
             result['global_data']['coefficients'] = coefficients_result['data']
             print(f"✅ Получено {len(coefficients_result['data'])} записей коэффициентов")
@@ -192,48 +461,49 @@ class WildBerriesAPI:
             result['errors'].append(f"Ошибка получения коэффициентов: {coefficients_result['error']}")
             print(f"❌ Ошибка коэффициентов: {coefficients_result['error']}")
         
-        # 3. Собираем все товары из всех листов для одного запроса опций
-        all_products = []
-        product_to_sheet_map = {}  # Маппинг баркод -> название листа
-        
-        for sheet_name, sheet_data in sheets.items():
-            products = sheet_data.get('products', [])
-            for product in products:
-                all_products.append(product)
-                barcode = product['barcode']
-                if barcode not in product_to_sheet_map:
-                    product_to_sheet_map[barcode] = []
-                product_to_sheet_map[barcode].append(sheet_name)
-        
-        # 4. Получаем опции для всех товаров одним запросом (1 запрос)
-        if all_products:
-            print(f"📦 Запрос опций для {len(all_products)} товаров...")
-            options_result = self.get_acceptance_options(all_products)
-            if options_result['success']:
-                result['global_data']['all_products_options'] = options_result['data']
-                print(f"✅ Получены опции для товаров")
-            else:
-                result['errors'].append(f"Ошибка получения опций: {options_result['error']}")
-                print(f"❌ Ошибка опций: {options_result['error']}")
-        else:
+        if options_result is None:
             print("⚠️  Нет товаров для запроса опций")
+        elif options_result['success']:
+            result['global_data']['all_products_options'] = options_result['data']
+            print(f"✅ Получены опции для товаров")
+        else:
+            result['errors'].append(f"Ошибка получения опций: {options_result['error']}")
+            print(f"❌ Ошибка опций: {options_result['error']}")
+        
+        # Позиции опций в ответе по баркоду: листы берут свои опции без прохода по всему ответу
+        option_positions = defaultdict(list)
+        if result['global_data']['all_products_options']:
+            for position, option_item in enumerate(result['global_data']['all_products_options'].get('result', [])):
+                option_positions[option_item.get('barcode')].append(position)
+        
+        # Индекс складов по названию общий для всех листов
+        warehouse_name_to_id = {
+            warehouse['name'].lower(): warehouse['ID'] for warehouse in result['global_data']['warehouses']
+        }
         
-        # 5. Обрабатываем результаты для каждого листа
+        # Обрабатываем результаты для каждого листа
         for sheet_name, sheet_data in sheets.items():
             sheet_result = self._process_sheet_data(
                 sheet_name, 
                 sheet_data, 
                 result['global_data'],
-                product_to_sheet_map
+                product_to_sheet_map,
+                option_positions,
+                warehouse_name_to_id
             )
             result['sheets'][sheet_name] = sheet_result
         
         return result
     
     def _process_sheet_data(self, sheet_name: str, sheet_data: Dict[str, Any], 
-                           global_data: Dict[str, Any], product_to_sheet_map: Dict[str, List[str]]) -> Dict[str, Any]:
+                           global_data: Dict[str, Any], product_to_sheet_map: Dict[str, List[str]],
+                           option_positions: Dict[str, List[int]],
+                           warehouse_name_to_id: Dict[str, int]) -> Dict[str, Any]:
         """
         Обрабатывает данные отдельного листа
+        
+        option_positions - индексы элементов all_products_options['result'] по баркоду
+        warehouse_name_to_id - ID складов по названию в нижнем регистре
         """
         sheet_result = {
             'sheet_name': sheet_name,
@@ -241,6 +511,8 @@ class WildBerriesAPI:
             'available_options': {},
             'coefficients': global_data['coefficients'],
             'available_slots': [],
+            'slots_by_warehouse': {},
+            'options_by_barcode': {},
             'errors': []
         }
         
@@ -251,14 +523,8 @@ class WildBerriesAPI:
         print(f"🔍 Поиск складов для листа {sheet_name}: {warehouse_names}")
         
         if 'warehouses' in global_data and global_data['warehouses']:
-            warehouses = global_data['warehouses']
-            name_to_id = {}
-            
-            for warehouse in warehouses:
-                name_to_id[warehouse['name'].lower()] = warehouse['ID']
-            
             for name in warehouse_names:
-                found_id = name_to_id.get(name.lower())
+                found_id = warehouse_name_to_id.get(name.lower())
                 warehouse_ids[name] = found_id
                 if found_id:
                     print(f"  ✅ {name} → ID: {found_id}")
@@ -274,16 +540,17 @@ class WildBerriesAPI:
         sheet_options = {'result': []}
         
         if 'all_products_options' in global_data and global_data['all_products_options']:
-            all_options = global_data['all_products_options']
+            all_option_items = global_data['all_products_options'].get('result', [])
             
-            # Фильтруем опции только для товаров этого листа
+            # Берем опции только для товаров этого листа, сохраняя порядок ответа API
             sheet_barcodes = {product['barcode'] for product in sheet_products}
-            
-            for option_item in all_options.get('result', []):
-                if option_item.get('barcode') in sheet_barcodes:
-                    sheet_options['result'].append(option_item)
+            positions = sorted(
+                position for barcode in sheet_barcodes for position in option_positions.get(barcode, ())
+            )
+            sheet_options['result'] = [all_option_items[position] for position in positions]
         
         sheet_result['available_options'] = sheet_options
+        sheet_result['options_by_barcode'] = {item['barcode']: item for item in sheet_options['result']}
         
         # Формируем доступные слоты
         if 'coefficients' in global_data and global_data['coefficients']:
@@ -299,37 +566,50 @@ class WildBerriesAPI:
                     coef['coefficient'] <= max_coefficient and 
                     coef['allowUnload'] is True):
                     
+                    # Названия складов и типов упаковки повторяются в тысячах слотов -
+                    # интернируем, чтобы все слоты ссылались на одну строку
                     available_slots.append({
                         'date': coef['date'],
                         'warehouse_id': coef['warehouseID'],
-                        'warehouse_name': coef['warehouseName'],
+                        'warehouse_name': sys.intern(coef['warehouseName']),
                         'coefficient': coef['coefficient'],
-                        'box_type': coef['boxTypeName'],
+                        'box_type': sys.intern(coef['boxTypeName']),
                         'is_free': coef['coefficient'] == 0
                     })
             
+            # Сортируем слоты по дате один раз здесь: группировки ниже и вывод получают их уже упорядоченными
+            # (сортировка стабильная, внутри даты сохраняется порядок ответа API)
+            available_slots.sort(key=itemgetter('date'))
             sheet_result['available_slots'] = available_slots
+            
+            # Группировку по складам считаем один раз здесь, а не при каждом выводе листа
+            slots_by_warehouse = defaultdict(list)
+            for slot in available_slots:
+                slots_by_warehouse[slot['warehouse_id']].append(slot)
+            sheet_result['slots_by_warehouse'] = dict(slots_by_warehouse)
         
         return sheet_result
 
 
 class WBMonitor:
-    def __init__(self, api_key: Optional[str] = None):
-        self.api = WildBerriesAPI(api_key)
+    def __init__(self, api_key: Optional[str] = None, limiter: Optional[WBRateLimiter] = None):
+        self.api = WildBerriesAPI(api_key, limiter)
     
-    def monitor_parsed_data(self, parsed_data_path: str = 'test/test_output/parsed_data.json') -> Dict[str, Any]:
+    def monitor_parsed_data(self, parsed_data_path: str = 'test/test_output/parsed_data.json',
+                            warehouses: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """
         Оптимизированный мониторинг всех листов из parsed_data.json одновременно
         
         Args:
             parsed_data_path: Путь к файлу parsed_data.json
+            warehouses: Уже полученный список складов (если None - запрашивается)
             
         Returns:
             Результаты мониторинга для всех листов
         """
         try:
-            with open(parsed_data_path, 'r', encoding='utf-8') as f:
-                parsed_data = json.load(f)
+            with open(parsed_data_path, 'rb') as f:
+                parsed_data = orjson.loads(f.read())
         except Exception as e:
             return {
                 'success': False,
@@ -337,11 +617,56 @@ class WBMonitor:
                 'data': None
             }
         
+        return self.monitor_parsed_dict(parsed_data, warehouses)
+    
+    def monitor_parsed_dict(self, parsed_data: Dict[str, Any],
+                            warehouses: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Оптимизированный мониторинг всех листов по уже загруженным данным парсинга
+        
+        Args:
+            parsed_data: Данные в формате parsed_data.json
+            warehouses: Уже полученный список складов (если None - запрашивается)
+            
+        Returns:
+            Результаты мониторинга для всех листов
+        """
         print("🔄 Выполняем оптимизированные API запросы...")
         
         # Используем оптимизированный метод (всего 3 API запроса)
-        optimized_results = self.api.check_available_slots_optimized(parsed_data)
+        optimized_results = self.api.check_available_slots_optimized(parsed_data, warehouses)
+        
+        return self._summarize_results(optimized_results)
+    
+    async def monitor_parsed_dict_async(self, parsed_data: Dict[str, Any],
+                                        warehouses: Optional[List[Dict[str, Any]]] = None,
+                                        compiled: Optional[CompiledProducts] = None) -> Dict[str, Any]:
+        """
+        Асинхронный вариант monitor_parsed_dict: 3 запроса к WB выполняются параллельно
+        и прерываются вместе с вызывающей задачей
+        
+        compiled - результат compile_parsed_data для этих же parsed_data (если None - собирается заново)
+        """
+        print("🔄 Выполняем оптимизированные API запросы...")
+        
+        optimized_results = await self.api.check_available_slots_optimized_async(parsed_data, warehouses, compiled)
         
+        return self._summarize_results(optimized_results)
+    
+    def compile_parsed_data(self, parsed_data: Dict[str, Any]) -> CompiledProducts:
+        """Подготавливает товары из данных парсинга один раз для всех API циклов до следующего парсинга"""
+        return self.api.compile_products(parsed_data.get('sheets', {}))
+    
+    async def close(self):
+        """Закрывает HTTP сессии API клиента"""
+        await self.api.close()
+    
+    def get_rate_headers(self) -> Dict[str, Dict[str, str]]:
+        """Возвращает заголовки лимитов последних ответов по каждому endpoint'у"""
+        return dict(self.api.limiter.last_headers)
+    
+    def _summarize_results(self, optimized_results: Dict[str, Any]) -> Dict[str, Any]:
+        """Преобразует результаты проверки слотов в формат мониторинга со сводкой"""
         if optimized_results.get('errors'):
             return {
                 'success': False,
@@ -385,7 +710,8 @@ class WBMonitor:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"{output_dir}/wb_monitoring_results_{timestamp}.json"
         
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+        # orjson пишет UTF-8 сразу; ID складов в ключах группировок - числа
+        with open(filename, 'wb') as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
         
         return filename
\ No newline at end of file
@@ -1,20 +1,37 @@
 #!/usr/bin/env python3
+import io
 import os
-import json
+import sys
+import time
 import asyncio
 import logging
 import hashlib
 from datetime import datetime
-from typing import Dict, Any, Optional
-from dataclasses import dataclass
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, Any, Optional, Tuple
+from dataclasses import dataclass, asdict
+from urllib.parse import urlparse
 
+import orjson
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.filters import Command
+from aiogram.methods import SendMessage
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from dotenv import load_dotenv
 
+# Добавляем src в путь для импорта общих модулей
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+from box_types import PACKAGING_EMOJI
+from date_format import format_dt
+
 # Загружаем переменные окружения
 load_dotenv(override=True)
 
@@ -22,6 +39,46 @@ load_dotenv(override=True)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Заголовки для прямой отправки заранее сериализованного JSON в Bot API
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Лимиты длины сообщения Telegram
+_MESSAGE_LIMIT = 4000
+_MESSAGE_TRUNCATE_AT = 3900
+# Сколько символов буфера форматируем: сообщение - это буфер без последнего перевода строки,
+# поэтому форматирование можно прервать, только когда буфер длиннее лимита хотя бы на 2 символа
+_FORMAT_BUDGET = _MESSAGE_LIMIT + 1
+
+# Максимум одновременных отправок при рассылке
+_BROADCAST_CONCURRENCY = 20
+
+# Интервал между отправками при рассылке: общий темп не выше ~25 сообщений в секунду
+# (лимит Telegram для рассылок - около 30 сообщений в секунду)
+_BROADCAST_INTERVAL = 1 / 25
+
+# Сколько раз повторяем отправку после ограничения частоты (429) от Telegram
+_RETRY_AFTER_ATTEMPTS = 3
+
+# Разделитель между товарами в сообщении
+_SEPARATOR = "-" * 60
+
+_slot_date = itemgetter('date')
+
+@lru_cache(maxsize=1024)
+def _parse_slot_date(dt_str: str) -> Optional[datetime]:
+    """Дата слота без часового пояса для сравнения с периодом поставки (None - не удалось разобрать)"""
+    try:
+        return datetime.fromisoformat(dt_str.replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+@dataclass(slots=True)
+class Subscriber:
+    """Состояние подписчика: хеш последнего отправленного сообщения"""
+    last_hash: Optional[str] = None
+
+
 @dataclass
 class TelegramNotifier:
     """Класс для отправки уведомлений через Telegram бота"""
@@ -34,8 +91,12 @@ class TelegramNotifier:
         # Создаем бота с базовой конфигурацией
         self.bot = Bot(token=self.bot_token)
         self.dp = Dispatcher(storage=MemoryStorage())
-        self.subscribers: Dict[int, Dict[str, Optional[str]]] = {}  # {user_id: {"last_hash": "..."}}
+        self.subscribers: Dict[int, Subscriber] = {}
         self.subscriptions_file = 'subscriptions.json'
+        self._last_message: Optional[Tuple[Any, str]] = None  # (отпечаток результатов, сформированное сообщение)
+        # Общий темп отправок рассылки: время (time.monotonic), раньше которого следующее сообщение не уходит
+        self._send_lock = asyncio.Lock()
+        self._next_send_at = 0.0
         
         # Загружаем подписки из файла
         self.load_subscriptions()
@@ -47,19 +108,21 @@ class TelegramNotifier:
         """Загружает список подписчиков из файла"""
         try:
             if os.path.exists(self.subscriptions_file):
-                with open(self.subscriptions_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                with open(self.subscriptions_file, 'rb') as f:
+                    data = orjson.loads(f.read())
                     
                     # Поддержка старого формата для миграции
                     if 'subscribed_users' in data:
                         # Старый формат - конвертируем
                         old_users = data.get('subscribed_users', [])
-                        self.subscribers = {user_id: {"last_hash": None} for user_id in old_users}
+                        self.subscribers = {user_id: Subscriber() for user_id in old_users}
                         logger.info(f"Мигрирован старый формат подписок для {len(old_users)} пользователей")
                     else:
                         # Новый формат
                         subscribers_data = data.get('subscribers', {})
-                        self.subscribers = {int(k): v for k, v in subscribers_data.items()}
+                        self.subscribers = {
+                            int(k): Subscriber(last_hash=v.get('last_hash')) for k, v in subscribers_data.items()
+                        }
                     
                 logger.info(f"Загружено {len(self.subscribers)} подписчиков")
         except Exception as e:
@@ -70,11 +133,11 @@ class TelegramNotifier:
         """Сохраняет список подписчиков в файл"""
         try:
             data = {
-                'subscribers': {str(k): v for k, v in self.subscribers.items()},
+                'subscribers': {str(k): asdict(v) for k, v in self.subscribers.items()},
                 'updated_at': datetime.now().isoformat()
             }
-            with open(self.subscriptions_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with open(self.subscriptions_file, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
             logger.info(f"Сохранено {len(self.subscribers)} подписчиков")
         except Exception as e:
             logger.error(f"Ошибка при сохранении подписок: {e}")
@@ -88,7 +151,7 @@ class TelegramNotifier:
             username = message.from_user.username or "Неизвестно"
             
             # Автоматически подписываем пользователя
-            self.subscribers[user_id] = {"last_hash": None}
+            self.subscribers[user_id] = Subscriber()
             self.save_subscriptions()
             
             # Создаем клавиатуру с кнопкой отписки
@@ -143,7 +206,7 @@ class TelegramNotifier:
             username = callback.from_user.username or "Неизвестно"
             
             if user_id not in self.subscribers:
-                self.subscribers[user_id] = {"last_hash": None}
+                self.subscribers[user_id] = Subscriber()
                 self.save_subscriptions()
                 
                 # Создаем клавиатуру с кнопкой отписки
@@ -192,8 +255,8 @@ class TelegramNotifier:
             # Проверим, есть ли файл с последними результатами мониторинга
             try:
                 if os.path.exists('test/test_output/parsed_data.json'):
-                    with open('test/test_output/parsed_data.json', 'r', encoding='utf-8') as f:
-                        parsed_data = json.load(f)
+                    with open('test/test_output/parsed_data.json', 'rb') as f:
+                        parsed_data = orjson.loads(f.read())
                         parsed_at = parsed_data.get('parsed_at', 'N/A')
                         total_sheets = parsed_data.get('total_sheets', 0)
                         
@@ -216,11 +279,7 @@ class TelegramNotifier:
     
     def format_datetime(self, dt_str: str) -> str:
         """Форматирует дату для красивого вывода"""
-        try:
-            dt = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-            return dt.strftime('%d.%m %H:%M')
-        except:
-            return dt_str
+        return format_dt(dt_str)
     
     def format_monitoring_message(self, parsed_data: Dict[str, Any], monitoring_results: Dict[str, Any]) -> str:
         """Форматирует сообщение с результатами мониторинга в том же формате что и консоль"""
@@ -230,54 +289,60 @@ class TelegramNotifier:
         
         summary = monitoring_results.get('summary', {})
         
-        message_parts = [
-            f"🎯 <b>WB SLOTS UPDATE</b>",
-            "",
-            f"📊 Обработано листов: {summary.get('total_sheets', 0)}",
-            ""
-        ]
+        # Каждая строка пишется с завершающим переводом строки, пустая строка - просто "\n"
+        out = io.StringIO()
+        out.write(f"🎯 <b>WB SLOTS UPDATE</b>\n\n")
+        out.write(f"📊 Обработано листов: {summary.get('total_sheets', 0)}\n\n")
         
         # Обрабатываем каждый лист
         for sheet_name, sheet_data in parsed_data.get('sheets', {}).items():
+            # Все, что дальше лимита, все равно будет обрезано - не форматируем лишние листы
+            if out.tell() > _FORMAT_BUDGET:
+                break
+            
             monitoring_data = monitoring_results.get('sheets', {}).get(sheet_name, {})
-            available_slots = monitoring_data.get('available_slots', [])
-            available_options = monitoring_data.get('available_options', {})
+            slots_by_warehouse = monitoring_data.get('slots_by_warehouse', {})
+            options_by_barcode = monitoring_data.get('options_by_barcode', {})
             
-            message_parts.append(f"📋 <b>{sheet_name}</b>")
-            message_parts.append(f"📅 {sheet_data.get('start_date', 'N/A')} - {sheet_data.get('end_date', 'N/A')}")
+            out.write(f"📋 <b>{sheet_name}</b>\n")
+            out.write(f"📅 {sheet_data.get('start_date', 'N/A')} - {sheet_data.get('end_date', 'N/A')}\n")
             
             # Показываем ошибки, если есть
             errors = monitoring_data.get('errors', [])
             if errors:
-                message_parts.append(f"⚠️ Ошибки: {'; '.join(errors)}")
+                out.write(f"⚠️ Ошибки: {'; '.join(errors)}\n")
             
             # Обрабатываем товары
             products = sheet_data.get('products', [])
             warehouse_ids = monitoring_data.get('warehouse_ids', {})
             
             if not products:
-                message_parts.append("   Нет товаров для мониторинга")
-                message_parts.append("")
-                continue
-            
-            # Используем тот же алгоритм что и в консоли
-            self.format_products_analysis_for_telegram(
-                message_parts, products, available_slots, 
-                warehouse_ids, available_options, 
-                sheet_data.get('start_date'), sheet_data.get('end_date')
-            )
-            message_parts.append("")
+                out.write("   Нет товаров для мониторинга\n")
+            else:
+                # Используем тот же алгоритм что и в консоли
+                self.format_products_analysis_for_telegram(
+                    out, products, slots_by_warehouse, 
+                    warehouse_ids, options_by_barcode, 
+                    sheet_data.get('start_date'), sheet_data.get('end_date'),
+                    budget=_FORMAT_BUDGET
+                )
+            out.write("\n")
         
-        # Ограничиваем длину сообщения
-        message = "\n".join(message_parts)
-        if len(message) > 4000:
-            message = message[:3900] + "\n\n... (сообщение обрезано)"
+        # Ограничиваем длину сообщения (последний перевод строки не нужен)
+        message = out.getvalue()[:-1]
+        if len(message) > _MESSAGE_LIMIT:
+            message = message[:_MESSAGE_TRUNCATE_AT] + "\n\n... (сообщение обрезано)"
         
         return message
     
-    def format_products_analysis_for_telegram(self, message_parts: list, products: list, available_slots: list, 
-                                            _warehouse_ids: dict, available_options: dict, start_date: str = None, end_date: str = None):
-        """Форматирует анализ товаров для Telegram в том же формате что и консоль"""
+    def format_products_analysis_for_telegram(self, out: io.StringIO, products: list, slots_by_warehouse: dict, 
+                                            _warehouse_ids: dict, options_by_barcode: dict, start_date: str = None, end_date: str = None,
+                                            budget: Optional[int] = None):
+        """Форматирует анализ товаров для Telegram в том же формате что и консоль
+        
+        budget - максимальная длина сообщения; когда в out записано больше,
+        форматирование прекращается, так как остаток все равно будет обрезан.
+        """
         
         # Парсим даты для фильтрации
         start_date_obj = None
@@ -298,155 +363,148 @@ class TelegramNotifier:
                 except ValueError:
                     pass
         
-        # Создаем словарь опций по баркодам
-        options_by_barcode = {}
-        if available_options and 'result' in available_options:
-            for item in available_options['result']:
-                barcode = item.get('barcode', '')
-                options_by_barcode[barcode] = item
-        
-        # Создаем словарь слотов по складам
-        slots_by_warehouse = {}
-        for slot in available_slots:
-            warehouse_id = slot['warehouse_id']
-            if warehouse_id not in slots_by_warehouse:
-                slots_by_warehouse[warehouse_id] = []
-            slots_by_warehouse[warehouse_id].append(slot)
+        # Названия складов одинаковы для всех товаров листа - берем их из слотов один раз
+        warehouse_name_by_id = {
+            warehouse_id: slots[0]['warehouse_name'] for warehouse_id, slots in slots_by_warehouse.items()
+        }
+        # Типы упаковки, для которых на складе есть слоты: склады без нужных товару упаковок пропускаются без перебора слотов
+        box_types_by_warehouse = {
+            warehouse_id: frozenset(slot['box_type'] for slot in slots) for warehouse_id, slots in slots_by_warehouse.items()
+        }
         
         # Обрабатываем каждый товар
         for product in products:
             barcode = product['barcode']
             quantity = product['quantity']
             
-            message_parts.append(f"📦 <b>БАРКОД: {barcode}</b> (Количество: {quantity})")
+            out.write(f"📦 <b>БАРКОД: {barcode}</b> (Количество: {quantity})\n")
             
             # Проверяем опции приемки для этого баркода
             barcode_options = options_by_barcode.get(barcode)
             
             if not barcode_options:
-                message_parts.append("   ❌ Нет данных об опциях приемки")
+                out.write("   ❌ Нет данных об опциях приемки\n")
                 continue
             
             if barcode_options.get('isError'):
                 error = barcode_options.get('error', {})
-                message_parts.append(f"   ❌ ОШИБКА: {error.get('title', 'Unknown')} - {error.get('detail', 'No details')}")
+                out.write(f"   ❌ ОШИБКА: {error.get('title', 'Unknown')} - {error.get('detail', 'No details')}\n")
                 continue
             
             warehouses_for_barcode = barcode_options.get('warehouses', [])
             if not warehouses_for_barcode:
-                message_parts.append("   ❌ Нет доступных складов для этого товара")
+                out.write("   ❌ Нет доступных складов для этого товара\n")
                 continue
             
             # Отображаем информацию по каждому доступному складу
             has_available_warehouses = False
             
-            # Сортируем склады по названию для стабильного порядка
-            sorted_warehouses = []
-            for warehouse_option in warehouses_for_barcode:
-                warehouse_id = warehouse_option['warehouseID']
-                warehouse_slots = slots_by_warehouse.get(warehouse_id, [])
-                if warehouse_slots:
-                    warehouse_name = warehouse_slots[0]['warehouse_name']
-                    sorted_warehouses.append((warehouse_name, warehouse_option))
-            
-            # Сортируем по названию склада
-            sorted_warehouses.sort(key=lambda x: x[0])
+            # Сортируем склады со слотами по названию для стабильного порядка
+            sorted_warehouses = sorted(
+                (
+                    (warehouse_name_by_id[warehouse_option['warehouseID']], warehouse_option)
+                    for warehouse_option in warehouses_for_barcode
+                    if warehouse_option['warehouseID'] in warehouse_name_by_id
+                ),
+                key=lambda x: x[0]
+            )
             
             for warehouse_name, warehouse_option in sorted_warehouses:
                 warehouse_id = warehouse_option['warehouseID']
                 
-                # Проверяем, есть ли этот склад в наших слотах
-                warehouse_slots = slots_by_warehouse.get(warehouse_id, [])
+                # Определяем доступные упаковки для товара на этом складе
+                available_packaging = {
+                    name: emoji for flag, name, emoji in PACKAGING_EMOJI if warehouse_option.get(flag)
+                }
+                pack_set = frozenset(available_packaging)
                 
-                if not warehouse_slots:
-                    continue  # Пропускаем склады без доступных слотов
+                # Склады без слотов нужных упаковок пропускаем, не перебирая их слоты
+                if not pack_set & box_types_by_warehouse[warehouse_id]:
+                    continue
                 
-                # Определяем доступные упаковки для товара на этом складе
-                available_packaging = {}
-                if warehouse_option.get('canBox'):
-                    available_packaging['Короба'] = '📦'
-                if warehouse_option.get('canMonopallet'):
-                    available_packaging['Монопаллеты'] = '🚛'
-                if warehouse_option.get('canSupersafe'):
-                    available_packaging['Суперсейф'] = '🔒'
+                warehouse_slots = slots_by_warehouse[warehouse_id]
                 
                 # Фильтруем слоты только по доступным упаковкам и датам
-                filtered_slots = []
-                for slot in warehouse_slots:
-                    if slot['box_type'] in available_packaging:
-                        # Проверяем, попадает ли дата слота в диапазон поставки
-                        if start_date_obj and end_date_obj:
-                            try:
-                                slot_date = datetime.fromisoformat(slot['date'].replace('Z', '+00:00')).replace(tzinfo=None)
-                                if start_date_obj <= slot_date <= end_date_obj:
-                                    filtered_slots.append(slot)
-                            except ValueError:
-                                # Если не удается парсить дату, оставляем слот (для обратной совместимости)
-                                filtered_slots.append(slot)
-                        else:
-                            # Если нет диапазона дат, оставляем слот
-                            filtered_slots.append(slot)
+                if start_date_obj and end_date_obj:
+                    # Слоты с датой, которую не удается разобрать, оставляем (для обратной совместимости)
+                    filtered_slots = [
+                        slot for slot in warehouse_slots
+                        if slot['box_type'] in pack_set
+                        and ((slot_date := _parse_slot_date(slot['date'])) is None
+                             or start_date_obj <= slot_date <= end_date_obj)
+                    ]
+                else:
+                    filtered_slots = [slot for slot in warehouse_slots if slot['box_type'] in pack_set]
                 
                 if not filtered_slots:
                     continue  # Пропускаем склады без подходящих слотов
                 
                 has_available_warehouses = True
-                message_parts.append(f"   🏪 <b>{warehouse_name}</b> (ID: {warehouse_id})")
+                out.write(f"   🏪 <b>{warehouse_name}</b> (ID: {warehouse_id})\n")
                 
                 # Показываем доступные упаковки
                 if available_packaging:
                     packaging_list = [f"{emoji} {name}" for name, emoji in available_packaging.items()]
-                    message_parts.append(f"      Упаковки: {', '.join(packaging_list)}")
+                    out.write(f"      Упаковки: {', '.join(packaging_list)}\n")
                 else:
-                    message_parts.append("      ❌ Нет доступных упаковок")
+                    out.write("      ❌ Нет доступных упаковок\n")
                 
                 # Показываем только подходящие слоты
-                message_parts.append("      📅 Доступные слоты:")
+                out.write("      📅 Доступные слоты:\n")
                 
-                # Группируем отфильтрованные слоты по дате
-                slots_by_date = {}
-                for slot in filtered_slots:
-                    date = slot['date']
-                    if date not in slots_by_date:
-                        slots_by_date[date] = []
-                    slots_by_date[date].append(slot)
-                
-                # Сортируем даты
-                sorted_dates = sorted(slots_by_date.keys())
-                
-                if not sorted_dates:
-                    message_parts.append("         ❌ Нет подходящих слотов")
-                else:
-                    for date in sorted_dates:
-                        date_slots = slots_by_date[date]
-                        formatted_date = self.format_datetime(date)
+                # Группируем отфильтрованные слоты по дате: WildBerriesAPI отдает их уже отсортированными
+                for date, date_slots in groupby(filtered_slots, key=_slot_date):
+                    formatted_date = format_dt(date)
+                    
+                    for slot in date_slots:
+                        coefficient = slot['coefficient']
+                        box_type = slot['box_type']
                         
-                        for slot in date_slots:
-                            coefficient = slot['coefficient']
-                            box_type = slot['box_type']
-                            
-                            if coefficient == 0:
-                                cost_info = "🆓 <b>Бесплатно</b>"
-                            else:
-                                cost_info = f"💰 Множитель: {coefficient}"
-                            
-                            message_parts.append(f"         {formatted_date} ({box_type}): {cost_info}")
+                        if coefficient == 0:
+                            cost_info = "🆓 <b>Бесплатно</b>"
+                        else:
+                            cost_info = f"💰 Множитель: {coefficient}"
+                        
+                        out.write(f"         {formatted_date} ({box_type}): {cost_info}\n")
                 
-                message_parts.append("")  # Пустая строка между складами
+                out.write("\n")  # Пустая строка между складами
+                
+                if budget is not None and out.tell() > budget:
+                    return
             
             if not has_available_warehouses:
-                message_parts.append("   ❌ Нет доступных складов с открытыми слотами")
+                out.write("   ❌ Нет доступных складов с открытыми слотами\n")
+            
+            out.write(_SEPARATOR + "\n")  # Разделитель между товарами
             
-            message_parts.append("-" * 60)  # Разделитель между товарами
+            if budget is not None and out.tell() > budget:
+                return
     
-    async def send_notification(self, parsed_data: Dict[str, Any], monitoring_results: Dict[str, Any]):
-        """Отправляет уведомление подписчикам с персональной проверкой хешей"""
+    async def _wait_send_slot(self):
+        """Ждет своей очереди на отправку, чтобы все параллельные отправки вместе шли не чаще _BROADCAST_INTERVAL"""
+        async with self._send_lock:
+            now = time.monotonic()
+            send_at = max(now, self._next_send_at)
+            self._next_send_at = send_at + _BROADCAST_INTERVAL
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+    
+    async def send_notification(self, parsed_data: Dict[str, Any], monitoring_results: Dict[str, Any],
+                                signature: Any = None):
+        """Отправляет уведомление подписчикам с персональной проверкой хешей
+        
+        signature - отпечаток результатов; если он не изменился, сообщение не форматируется заново
+        """
         
         if not self.subscribers:
             logger.info("Нет подписчиков для отправки уведомлений")
             return
         
-        message = self.format_monitoring_message(parsed_data, monitoring_results)
+        if signature is not None and self._last_message and self._last_message[0] == signature:
+            message = self._last_message[1]
+        else:
+            message = self.format_monitoring_message(parsed_data, monitoring_results)
+            self._last_message = (signature, message) if signature is not None else None
         
         # Фильтруем сообщения об ошибках мониторинга
         if message.startswith("❌ Ошибка мониторинга:"):
@@ -456,13 +514,11 @@ class TelegramNotifier:
         new_message_hash = self.calculate_message_hash(message)
         
         # Отправляем сообщение только тем, у кого хеш отличается
-        successful_sends = 0
-        failed_sends = 0
         users_to_send = []
         
         # Определяем кому отправлять
-        for user_id, user_data in self.subscribers.items():
-            user_last_hash = user_data.get("last_hash")
+        for user_id, subscriber in self.subscribers.items():
+            user_last_hash = subscriber.last_hash
             if user_last_hash != new_message_hash:
                 users_to_send.append(user_id)
                 if user_last_hash is None:
@@ -476,29 +532,68 @@ class TelegramNotifier:
         
         logger.info(f"Отправляем уведомления {len(users_to_send)} из {len(self.subscribers)} подписчиков")
         
-        # Отправляем сообщения
-        for user_id in users_to_send:
-            try:
-                await self.bot.send_message(
-                    chat_id=user_id,
-                    text=message,
-                    parse_mode='HTML',
-                    disable_web_page_preview=True
-                )
-                # Обновляем хеш для этого пользователя
-                self.subscribers[user_id]["last_hash"] = new_message_hash
-                successful_sends += 1
-                await asyncio.sleep(0.1)  # Небольшая пауза между отправками
-                
-            except Exception as e:
-                logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
-                
-                # Если пользователь заблокировал бота, удаляем его из подписчиков
-                if "blocked" in str(e).lower() or "chat not found" in str(e).lower():
-                    del self.subscribers[user_id]
-                    logger.info(f"Пользователь {user_id} удален из подписчиков (заблокирован)")
-                
-                failed_sends += 1
+        # Тело запроса сериализуем один раз: для каждого пользователя меняется только chat_id
+        body_template = orjson.dumps({
+            "text": message,
+            "parse_mode": "HTML",
+            "disable_web_page_preview": True
+        })[:-1]
+        url = self.bot.session.api.api_url(token=self.bot.token, method="sendMessage")
+        session = await self.bot.session.create_session()
+        # Метод нужен только для разбора ошибок Telegram средствами aiogram
+        error_method = SendMessage(chat_id=0, text=message, parse_mode='HTML', disable_web_page_preview=True)
+        
+        semaphore = asyncio.Semaphore(_BROADCAST_CONCURRENCY)
+        
+        async def _send(user_id: int):
+            """Отправляет сообщение одному пользователю, возвращает (user_id, ошибка или None)"""
+            body = body_template + b',"chat_id":' + str(user_id).encode() + b'}'
+            async with semaphore:
+                for attempt in range(_RETRY_AFTER_ATTEMPTS):
+                    try:
+                        await self._wait_send_slot()
+                        async with session.post(url, data=body, headers=_JSON_HEADERS) as response:
+                            if response.status != 200:
+                                # Поднимает соответствующее исключение aiogram с описанием ошибки
+                                self.bot.session.check_response(
+                                    bot=self.bot,
+                                    method=error_method,
+                                    status_code=response.status,
+                                    content=await response.text()
+                                )
+                        return user_id, None
+                    except TelegramRetryAfter as e:
+                        if attempt == _RETRY_AFTER_ATTEMPTS - 1:
+                            logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
+                            return user_id, e
+                        logger.warning(f"Превышен лимит Telegram для {user_id}, повтор через {e.retry_after}с")
+                        await asyncio.sleep(e.retry_after)
+                    except Exception as e:
+                        logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
+                        return user_id, e
+        
+        # Отправляем сообщения параллельно напрямую через aiohttp-сессию бота, минуя pydantic-модели aiogram
+        results = await asyncio.gather(*[_send(user_id) for user_id in users_to_send])
+        
+        # Обновляем состояние подписчиков одним проходом после завершения всех отправок
+        ok = {user_id for user_id, error in results if error is None}
+        # Если пользователь заблокировал бота, удаляем его из подписчиков
+        blocked = {
+            user_id for user_id, error in results
+            if isinstance(error, TelegramForbiddenError)
+            or (isinstance(error, TelegramBadRequest) and "chat not found" in error.message.lower())
+        }
+        
+        for user_id in ok:
+            # Пользователь мог отписаться, пока шла рассылка
+            if user_id in self.subscribers:
+                self.subscribers[user_id].last_hash = new_message_hash
+        for user_id in blocked:
+            self.subscribers.pop(user_id, None)
+            logger.info(f"Пользователь {user_id} удален из подписчиков (заблокирован)")
+        
+        successful_sends = len(ok)
+        failed_sends = len(results) - successful_sends
         
         # Сохраняем обновленные данные подписчиков
         self.save_subscriptions()
@@ -506,10 +601,45 @@ class TelegramNotifier:
         logger.info(f"Уведомления отправлены: {successful_sends} успешно, {failed_sends} ошибок")
     
     async def start_bot(self):
-        """Запускает бота"""
+        """Запускает бота в режиме long polling (для локальной разработки)"""
         logger.info("Запуск Telegram бота...")
         await self.dp.start_polling(self.bot, polling_timeout=30)
     
+    async def start_webhook(self, url: str, port: int, secret_token: str, host: str = '0.0.0.0'):
+        """
+        Запускает бота в режиме webhook: Telegram сам присылает обновления,
+        поэтому не нужно держать постоянные long polling запросы
+        
+        Args:
+            url: Публичный HTTPS адрес webhook (путь из него используется для приема обновлений)
+            port: Локальный порт HTTP сервера
+            secret_token: Секрет webhook: Telegram передает его в заголовке каждого запроса,
+                запросы без него отклоняются (иначе любой, кто знает адрес, может слать поддельные обновления)
+            host: Локальный адрес HTTP сервера
+        """
+        if not secret_token:
+            raise ValueError("Для режима webhook нужен TELEGRAM_WEBHOOK_SECRET")
+        
+        logger.info(f"Запуск Telegram бота в режиме webhook: {url}")
+        
+        app = web.Application()
+        SimpleRequestHandler(dispatcher=self.dp, bot=self.bot, secret_token=secret_token).register(
+            app, path=urlparse(url).path or '/'
+        )
+        setup_application(app, self.dp, bot=self.bot)
+        
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        await self.bot.set_webhook(url, secret_token=secret_token)
+        
+        try:
+            # Работаем до отмены задачи
+            await asyncio.Event().wait()
+        finally:
+            await self.bot.delete_webhook()
+            await runner.cleanup()
+    
     async def stop_bot(self):
         """Останавливает бота"""
         logger.info("Остановка Telegram бота...")
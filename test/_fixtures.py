@@ -0,0 +1,42 @@
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+# Самая быстрая доступная JSON-библиотека: orjson (нет под PyPy) -> ujson -> stdlib
+try:
+    import orjson as _json_lib
+    _JSON_MODE = 'orjson'
+except ImportError:
+    try:
+        import ujson as _json_lib
+        _JSON_MODE = 'ujson'
+    except ImportError:
+        _json_lib = json
+        _JSON_MODE = 'stdlib'
+
+
+PARSED_DATA_PATH = 'test/test_output/parsed_data.json'
+
+
+def _json_dumps(obj: Any, pretty: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """Сериализует объект в JSON (UTF-8 bytes)"""
+    if _JSON_MODE == 'orjson':
+        option = _json_lib.OPT_NON_STR_KEYS | (_json_lib.OPT_INDENT_2 if pretty else 0)
+        return _json_lib.dumps(obj, default=default, option=option)
+    if _JSON_MODE == 'ujson':
+        return _json_lib.dumps(obj, ensure_ascii=False, indent=2 if pretty else 0, default=default).encode('utf-8')
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2, default=default).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default).encode('utf-8')
+
+
+def _json_loads(data: bytes) -> Any:
+    """Разбирает JSON из bytes или str"""
+    return _json_lib.loads(data)
+
+
+@lru_cache(maxsize=1)
+def _load_parsed_data(path: str = PARSED_DATA_PATH) -> dict:
+    """Загружает parsed_data.json один раз за запуск тестов (данные только читаются)"""
+    return _json_loads(Path(path).read_bytes())
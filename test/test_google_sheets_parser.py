@@ -2,10 +2,14 @@
 
 import sys
 import os
-import json
 from datetime import datetime
+from pathlib import Path
 
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+import orjson
+
+# Под pytest путь к src/ добавляет conftest.py, при запуске скриптом - добавляем сами
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 from google_sheets_parser import create_parser_from_env
 
@@ -30,8 +34,9 @@ def test_google_sheets_parser():
         
         output_file = os.path.join(os.path.dirname(__file__), 'test_output', 'parsed_data.json')
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
+        Path(output_file).write_bytes(
+            orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        )
         
         print(f"✓ Результаты сохранены в {output_file}")
         
@@ -1,13 +1,51 @@
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+import gzip
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
 from datetime import datetime
+from typing import Any, Dict, Mapping, Optional
 from dotenv import load_dotenv
 
+from _fixtures import _json_dumps, _json_loads, _load_parsed_data
+
 
 load_dotenv()
 
 
+@dataclass(slots=True)
+class TestResult:
+    """Результат одной проверки WB API"""
+    __test__ = False  # не тестовый класс для pytest
+    
+    test_name: str
+    url: str
+    request_data: Any = None
+    status_code: Optional[int] = None
+    success: bool = False
+    timestamp: str = ''
+    response_headers: Optional[Mapping[str, str]] = None
+    data: Any = None
+    error: Optional[str] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Словарь для сохранения в JSON (request_data только если он был)"""
+        result = {field.name: getattr(self, field.name) for field in fields(self)}
+        if self.request_data is None:
+            del result['request_data']
+        return result
+
+
+def _json_default(obj: Any) -> Any:
+    """Сериализует заголовки ответа requests (копия в dict делается только при сохранении)"""
+    if isinstance(obj, CaseInsensitiveDict):
+        return dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
 class WBAPITester:
     def __init__(self):
         self.api_key = os.getenv('WB_API_KEY')
@@ -17,94 +55,75 @@ class WBAPITester:
             'Content-Type': 'application/json'
         }
         self.results = {}
-    
-    def test_get_warehouses(self):
-        """Тест получения списка складов WB"""
-        print("Тестируем получение списка складов...")
+        self._results_lock = threading.Lock()
+        self._start_run()
         
-        url = f"{self.base_url}/api/v1/warehouses"
+        # Общая сессия: keep-alive соединения к supplies-api переиспользуются между тестами
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    
+    def _start_run(self):
+        """Фиксирует время запуска: одна метка на все результаты и имя файла"""
+        run_ts = datetime.now()
+        self._run_ts = run_ts.isoformat()
+        self._run_tag = run_ts.strftime('%Y%m%d_%H%M%S')
+    
+    def _do_call(self, key: str, test_name: str, method: str, url: str, success_msg: str,
+                 request_data: Optional[Any] = None, **kwargs) -> TestResult:
+        """
+        Выполняет запрос к API и сохраняет результат теста
+        
+        Args:
+            key: Ключ результата в self.results
+            test_name: Название теста
+            method: HTTP метод
+            url: Адрес запроса
+            success_msg: Сообщение об успехе, {count} заменяется на len(data)
+            request_data: Данные запроса для отчета
+            **kwargs: Дополнительные параметры для session.request
+        """
+        test_result = TestResult(test_name=test_name, url=url, request_data=request_data, timestamp=self._run_ts)
         
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self.session.request(method, url, timeout=10, **kwargs)
             
-            test_result = {
-                'test_name': 'get_warehouses',
-                'url': url,
-                'status_code': response.status_code,
-                'success': response.status_code == 200,
-                'timestamp': datetime.now().isoformat(),
-                'response_headers': dict(response.headers),
-                'data': None,
-                'error': None
-            }
+            test_result.status_code = response.status_code
+            test_result.success = response.status_code == 200
+            test_result.response_headers = response.headers
             
             if response.status_code == 200:
-                data = response.json()
-                test_result['data'] = data
-                print(f"✓ Успешно получен список из {len(data)} складов")
+                data = _json_loads(response.content)
+                test_result.data = data
+                print(success_msg.format(count=len(data)))
             else:
-                test_result['error'] = response.text
+                test_result.error = response.text
                 print(f"✗ Ошибка: {response.status_code} - {response.text}")
                 
         except Exception as e:
-            test_result = {
-                'test_name': 'get_warehouses',
-                'url': url,
-                'status_code': None,
-                'success': False,
-                'timestamp': datetime.now().isoformat(),
-                'response_headers': None,
-                'data': None,
-                'error': str(e)
-            }
+            test_result = TestResult(test_name=test_name, url=url, request_data=request_data,
+                                     timestamp=self._run_ts, error=str(e))
             print(f"✗ Исключение: {str(e)}")
         
-        self.results['warehouses'] = test_result
+        with self._results_lock:
+            self.results[key] = test_result
         return test_result
     
+    def test_get_warehouses(self):
+        """Тест получения списка складов WB"""
+        print("Тестируем получение списка складов...")
+        
+        url = f"{self.base_url}/api/v1/warehouses"
+        return self._do_call('warehouses', 'get_warehouses', 'GET', url,
+                             "✓ Успешно получен список из {count} складов")
+    
     def test_get_acceptance_coefficients(self):
         """Тест получения коэффициентов приемки"""
         print("Тестируем получение коэффициентов приемки...")
         
         url = f"{self.base_url}/api/v1/acceptance/coefficients"
-        
-        try:
-            response = requests.get(url, headers=self.headers)
-            
-            test_result = {
-                'test_name': 'get_acceptance_coefficients',
-                'url': url,
-                'status_code': response.status_code,
-                'success': response.status_code == 200,
-                'timestamp': datetime.now().isoformat(),
-                'response_headers': dict(response.headers),
-                'data': None,
-                'error': None
-            }
-            
-            if response.status_code == 200:
-                data = response.json()
-                test_result['data'] = data
-                print(f"✓ Успешно получены коэффициенты для {len(data)} записей")
-            else:
-                test_result['error'] = response.text
-                print(f"✗ Ошибка: {response.status_code} - {response.text}")
-                
-        except Exception as e:
-            test_result = {
-                'test_name': 'get_acceptance_coefficients',
-                'url': url,
-                'status_code': None,
-                'success': False,
-                'timestamp': datetime.now().isoformat(),
-                'response_headers': None,
-                'data': None,
-                'error': str(e)
-            }
-            print(f"✗ Исключение: {str(e)}")
-        
-        self.results['acceptance_coefficients'] = test_result
-        return test_result
+        return self._do_call('acceptance_coefficients', 'get_acceptance_coefficients', 'GET', url,
+                             "✓ Успешно получены коэффициенты для {count} записей")
     
     def test_get_acceptance_options(self):
         """Тест получения опций приемки"""
@@ -114,18 +133,14 @@ class WBAPITester:
         
         # Загружаем реальные данные из parsed_data.json
         try:
-            with open('test/test_output/parsed_data.json', 'r', encoding='utf-8') as f:
-                parsed_data = json.load(f)
+            parsed_data = _load_parsed_data()
             
             # Используем данные из листа "Тест"
             test_sheet = parsed_data['sheets']['Тест']
-            test_data = []
-            
-            for product in test_sheet['products']:
-                test_data.append({
-                    "quantity": product['quantity'],
-                    "barcode": product['barcode']
-                })
+            test_data = [
+                {"quantity": product['quantity'], "barcode": product['barcode']}
+                for product in test_sheet['products']
+            ]
             
             print(f"Используем реальные данные: {len(test_data)} товаров")
             
@@ -139,56 +154,26 @@ class WBAPITester:
                 }
             ]
         
-        try:
-            response = requests.post(url, headers=self.headers, json=test_data)
-            
-            test_result = {
-                'test_name': 'get_acceptance_options',
-                'url': url,
-                'request_data': test_data,
-                'status_code': response.status_code,
-                'success': response.status_code == 200,
-                'timestamp': datetime.now().isoformat(),
-                'response_headers': dict(response.headers),
-                'data': None,
-                'error': None
-            }
-            
-            if response.status_code == 200:
-                data = response.json()
-                test_result['data'] = data
-                print(f"✓ Успешно получены опции приемки")
-            else:
-                test_result['error'] = response.text
-                print(f"✗ Ошибка: {response.status_code} - {response.text}")
-                
-        except Exception as e:
-            test_result = {
-                'test_name': 'get_acceptance_options',
-                'url': url,
-                'request_data': test_data,
-                'status_code': None,
-                'success': False,
-                'timestamp': datetime.now().isoformat(),
-                'response_headers': None,
-                'data': None,
-                'error': str(e)
-            }
-            print(f"✗ Исключение: {str(e)}")
-        
-        self.results['acceptance_options'] = test_result
-        return test_result
+        # Тело кодируем сами: Content-Type: application/json уже задан в заголовках сессии
+        body = _json_dumps(test_data)
+        return self._do_call('acceptance_options', 'get_acceptance_options', 'POST', url,
+                             "✓ Успешно получены опции приемки", request_data=test_data, data=body)
     
     def save_results(self):
         """Сохранение результатов тестов в JSON файл"""
         output_dir = 'test/test_output'
         os.makedirs(output_dir, exist_ok=True)
         
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{output_dir}/wb_api_test_results_{timestamp}.json"
+        filename = f"{output_dir}/wb_api_test_results_{self._run_tag}.json.gz"
+        
+        results = {name: result.to_dict() for name, result in self.results.items()}
+        
+        # Файл читают в основном программы, поэтому по умолчанию пишем компактно (WB_TEST_PRETTY=1 - с отступами)
+        payload = _json_dumps(results, pretty=bool(os.getenv('WB_TEST_PRETTY')), default=_json_default)
         
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(self.results, f, ensure_ascii=False, indent=2)
+        # Весь буфер пишем одним вызовом; compresslevel=1 дает основную часть сжатия почти без затрат CPU
+        with gzip.open(filename, 'wb', compresslevel=1) as f:
+            f.write(payload)
         
         print(f"Результаты сохранены в: {filename}")
         return filename
@@ -196,27 +181,32 @@ class WBAPITester:
     def run_all_tests(self):
         """Запуск всех тестов"""
         print("=== Запуск тестов WB API ===\n")
-        
-        self.test_get_warehouses()
-        print()
-        
-        self.test_get_acceptance_coefficients()
-        print()
-        
-        self.test_get_acceptance_options()
+        self._start_run()
+        
+        # Проверки независимы и ждут сеть, поэтому выполняем их параллельно
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [
+                executor.submit(test)
+                for test in (self.test_get_warehouses,
+                             self.test_get_acceptance_coefficients,
+                             self.test_get_acceptance_options)
+            ]
+            for future in futures:
+                future.result()
         print()
         
         filename = self.save_results()
+        self.session.close()
         
         # Сводка результатов
         print("=== Сводка результатов ===")
-        successful_tests = sum(1 for result in self.results.values() if result['success'])
+        successful_tests = sum(1 for result in self.results.values() if result.success)
         total_tests = len(self.results)
         print(f"Успешных тестов: {successful_tests}/{total_tests}")
         
         for test_name, result in self.results.items():
-            status = "✓" if result['success'] else "✗"
-            print(f"{status} {test_name}: {result['status_code']}")
+            status = "✓" if result.success else "✗"
+            print(f"{status} {test_name}: {result.status_code}")
 
 
 if __name__ == "__main__":
@@ -1,11 +1,22 @@
+import io
 import sys
 import os
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+import asyncio
+from collections import defaultdict
 
+import pytest
+
+# Под pytest путь к src/ и корню проекта добавляет conftest.py, при запуске скриптом - добавляем сами
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import wb_monitor
 from wb_api import WBMonitor, WildBerriesAPI
-import json
 from datetime import datetime
 
+from _fixtures import _load_parsed_data
+
 
 def test_individual_api_methods():
     """Тестирует отдельные методы API"""
@@ -32,7 +43,10 @@ def test_individual_api_methods():
     # Тест поиска ID складов
     print("\n3. Тестируем поиск ID складов по названиям...")
     test_warehouse_names = ["Казань", "Новосибирск", "Электросталь", "несуществующий_склад"]
-    warehouse_ids = api.find_warehouse_ids_by_names(test_warehouse_names)
+    # Список складов уже получен в шаге 1 - повторно не запрашиваем
+    warehouse_ids = api.find_warehouse_ids_by_names(
+        test_warehouse_names, warehouses['data'] if warehouses['success'] else None
+    )
     
     for name, wid in warehouse_ids.items():
         status = "✓" if wid else "✗"
@@ -45,14 +59,21 @@ def test_individual_api_methods():
     }
 
 
-def test_monitoring_with_real_data():
+def test_monitoring_with_real_data(warehouses=None):
     """Тестирует мониторинг с реальными данными из parsed_data.json"""
     print("\n=== Тестирование мониторинга с реальными данными ===\n")
     
     monitor = WBMonitor()
     
+    # Данные парсинга уже загружены в память (_load_parsed_data кеширует файл) - повторно его не читаем
+    try:
+        parsed_data = _load_parsed_data()
+    except Exception as e:
+        print(f"✗ Не удалось загрузить parsed_data.json: {e}")
+        return {'success': False, 'error': str(e), 'data': None}
+    
     # Запускаем мониторинг
-    results = monitor.monitor_parsed_data()
+    results = monitor.monitor_parsed_dict(parsed_data, warehouses=warehouses)
     
     if not results['success']:
         print(f"✗ Ошибка мониторинга: {results['error']}")
@@ -63,40 +84,40 @@ def test_monitoring_with_real_data():
     print(f"Листов с доступными слотами: {results['summary']['sheets_with_slots']}")
     print(f"Всего доступных слотов: {results['summary']['total_available_slots']}")
     
-    # Детали по каждому листу
-    print("\n--- Детали по листам ---")
+    # Детали по каждому листу собираем в буфер и выводим одной записью
+    buf = io.StringIO()
+    buf.write("\n--- Детали по листам ---\n")
     for sheet_name, sheet_result in results['sheets'].items():
-        print(f"\nЛист: {sheet_name}")
-        print(f"Склады в таблице: {', '.join(sheet_result.get('warehouse_ids', {}).keys())}")
+        buf.write(f"\nЛист: {sheet_name}\n")
+        buf.write(f"Склады в таблице: {', '.join(sheet_result.get('warehouse_ids', {}).keys())}\n")
         
         # Показываем найденные ID складов
-        found_warehouses = [f"{name}:{wid}" for name, wid in sheet_result.get('warehouse_ids', {}).items() if wid]
+        found_warehouses = ', '.join(f"{name}:{wid}" for name, wid in sheet_result.get('warehouse_ids', {}).items() if wid)
         if found_warehouses:
-            print(f"Найденные склады: {', '.join(found_warehouses)}")
+            buf.write(f"Найденные склады: {found_warehouses}\n")
         
         # Показываем доступные слоты
         available_slots = sheet_result.get('available_slots', [])
         if available_slots:
-            print(f"Доступных слотов: {len(available_slots)}")
+            buf.write(f"Доступных слотов: {len(available_slots)}\n")
             
             # Группируем по складам
-            slots_by_warehouse = {}
+            slots_by_warehouse = defaultdict(list)
             for slot in available_slots:
-                warehouse_name = slot['warehouse_name']
-                if warehouse_name not in slots_by_warehouse:
-                    slots_by_warehouse[warehouse_name] = []
-                slots_by_warehouse[warehouse_name].append(slot)
+                slots_by_warehouse[slot['warehouse_name']].append(slot)
             
             for warehouse_name, slots in slots_by_warehouse.items():
-                free_slots = len([s for s in slots if s['is_free']])
+                free_slots = sum(1 for s in slots if s['is_free'])
                 paid_slots = len(slots) - free_slots
-                print(f"  {warehouse_name}: {len(slots)} слотов (бесплатных: {free_slots}, платных: {paid_slots})")
+                buf.write(f"  {warehouse_name}: {len(slots)} слотов (бесплатных: {free_slots}, платных: {paid_slots})\n")
         else:
-            print("Доступных слотов: 0")
+            buf.write("Доступных слотов: 0\n")
         
         # Показываем ошибки
         if sheet_result.get('errors'):
-            print(f"Ошибки: {'; '.join(sheet_result['errors'])}")
+            buf.write(f"Ошибки: {'; '.join(sheet_result['errors'])}\n")
+    
+    sys.stdout.write(buf.getvalue())
     
     # Сохраняем результаты
     filename = monitor.save_monitoring_results(results)
@@ -113,8 +134,7 @@ def test_specific_products():
     
     # Загружаем данные из parsed_data.json
     try:
-        with open('test/test_output/parsed_data.json', 'r', encoding='utf-8') as f:
-            parsed_data = json.load(f)
+        parsed_data = _load_parsed_data()
     except Exception as e:
         print(f"✗ Не удалось загрузить parsed_data.json: {e}")
         return None
@@ -127,9 +147,10 @@ def test_specific_products():
         print("✗ Нет товаров для тестирования")
         return None
     
-    print(f"Тестируем опции для {len(products)} товаров:")
+    lines = [f"Тестируем опции для {len(products)} товаров:"]
     for product in products:
-        print(f"  Баркод: {product['barcode']}, Количество: {product['quantity']}")
+        lines.append(f"  Баркод: {product['barcode']}, Количество: {product['quantity']}")
+    sys.stdout.write('\n'.join(lines) + '\n')
     
     # Тестируем опции приемки
     options_result = api.get_acceptance_options(products)
@@ -140,17 +161,18 @@ def test_specific_products():
         options_data = options_result['data']
         print(f"Request ID: {options_data.get('requestId', 'N/A')}")
         
+        lines = []
         for item in options_data.get('result', []):
             barcode = item.get('barcode')
-            print(f"\nБаркод: {barcode}")
+            lines.append(f"\nБаркод: {barcode}")
             
             if item.get('isError'):
                 error = item.get('error', {})
-                print(f"  ✗ Ошибка: {error.get('title', 'Unknown')} - {error.get('detail', 'No details')}")
+                lines.append(f"  ✗ Ошибка: {error.get('title', 'Unknown')} - {error.get('detail', 'No details')}")
             else:
                 warehouses = item.get('warehouses', [])
                 if warehouses:
-                    print(f"  ✓ Доступно складов: {len(warehouses)}")
+                    lines.append(f"  ✓ Доступно складов: {len(warehouses)}")
                     for warehouse in warehouses:
                         wid = warehouse['warehouseID']
                         options = []
@@ -161,15 +183,56 @@ def test_specific_products():
                         if warehouse.get('canSupersafe'):
                             options.append('Суперсейф')
                         
-                        print(f"    Склад {wid}: {', '.join(options) if options else 'Нет доступных опций'}")
+                        lines.append(f"    Склад {wid}: {', '.join(options) if options else 'Нет доступных опций'}")
                 else:
-                    print("  ✗ Нет доступных складов")
+                    lines.append("  ✗ Нет доступных складов")
+        if lines:
+            sys.stdout.write('\n'.join(lines) + '\n')
     else:
         print(f"✗ Ошибка получения опций: {options_result['error']}")
     
     return options_result
 
 
+@pytest.fixture
+def offline_monitor(monkeypatch):
+    """WBSlotsMonitor без Google таблиц и сети; executor отчетов останавливается после теста"""
+    monkeypatch.setattr(wb_monitor, 'create_parser_from_env', lambda: None)
+    monitor = wb_monitor.WBSlotsMonitor(quiet=True)
+    yield monitor
+    monitor._display_executor.shutdown(wait=True)
+
+
+def test_rate_limited_cycle_lowers_effective_rpm(offline_monitor, monkeypatch):
+    """429 от WB снижает темп API запросов, а не засчитывается как успешный цикл"""
+    async def rate_limited_request(method, url, **kwargs):
+        return {'success': False, 'data': None, 'error': 'HTTP 429: Too Many Requests'}
+    
+    monkeypatch.setattr(offline_monitor.wb_monitor.api, '_request_async', rate_limited_request)
+    offline_monitor.parsed_data = {'sheets': {'Тест': {'warehouses': [], 'products': [{'barcode': '1', 'quantity': 1}]}}}
+    offline_monitor._effective_rpm = 3.0
+    
+    api_result = asyncio.run(offline_monitor.run_api_request())
+    offline_monitor.update_effective_rpm(api_result)
+    
+    assert not api_result['success']
+    assert 'HTTP 429' in api_result['error']
+    assert offline_monitor._effective_rpm == 1.5
+    assert offline_monitor.api_limiter.rate == 1.5 / offline_monitor.target_minute_duration
+
+
+def test_local_errors_keep_effective_rpm(offline_monitor):
+    """Ошибки не от WB (нет данных парсинга, отмена при остановке) темп запросов не снижают"""
+    offline_monitor._effective_rpm = 3.0
+    
+    no_data_result = asyncio.run(offline_monitor.run_api_request())
+    offline_monitor.update_effective_rpm(no_data_result)
+    offline_monitor.update_effective_rpm({'success': False, 'error': 'API запрос отменен', 'api_time': 0.1})
+    
+    assert not no_data_result['success']
+    assert offline_monitor._effective_rpm == 3.0
+
+
 def main():
     """Основная функция для запуска всех тестов"""
     print("=== Запуск комплексного тестирования мониторинга WB ===")
@@ -178,11 +241,17 @@ def main():
     # 1. Тестируем отдельные методы API
     api_results = test_individual_api_methods()
     
+    # Без валидного ключа остальные тесты упрутся в те же 401/403 - не тратим на них запросы
+    warehouses_error = api_results['warehouses']['error'] or ''
+    if warehouses_error.startswith(('HTTP 401', 'HTTP 403')):
+        print("\n✗ Ошибка авторизации WB API, остальные тесты пропущены")
+        return
+    
     # 2. Тестируем опции для конкретных товаров
     options_results = test_specific_products()
     
     # 3. Тестируем полный мониторинг
-    monitoring_results = test_monitoring_with_real_data()
+    monitoring_results = test_monitoring_with_real_data(api_results['warehouses']['data'])
     
     # Сводка
     print("\n=== СВОДКА ТЕСТИРОВАНИЯ ===")
@@ -1,46 +1,153 @@
 #!/usr/bin/env python3
+import io
+import re
 import sys
 import os
 import time
-import json
+import heapq
 import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, List, Any, Optional, Tuple
+
+import orjson
 
 # Добавляем src в путь для импорта модулей
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
+from box_types import PACKAGING_EMOJI
+from date_format import format_dt
 from google_sheets_parser import create_parser_from_env
 from wb_api import WBMonitor, WildBerriesAPI
 
+# Подписи упаковок в отчете: "значок название"
+_PACKAGING_LABELS = {name: f"{emoji} {name}" for _, name, emoji in PACKAGING_EMOJI}
+
+# Постоянные части строк слотов
+_FREE_SLOT = "🆓 Бесплатно"
+_MULTIPLIER_PREFIX = "💰 Множитель: "
+
+_slot_date = itemgetter('date')
+
+_SIGNATURE_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+
+def _results_signature(parsed_sheets_json: bytes, monitoring_results: Dict[str, Any]) -> int:
+    """
+    Отпечаток того, что видит пользователь: листы, слоты, опции и ошибки (без timestamp цикла)
+    
+    parsed_sheets_json - листы парсинга, сериализованные один раз после парсинга
+    """
+    sheets = monitoring_results.get('sheets') or {}
+    return hash((parsed_sheets_json, orjson.dumps(
+        [
+            monitoring_results.get('success'),
+            monitoring_results.get('error'),
+            {
+                name: [sheet.get('available_slots'), sheet.get('available_options'), sheet.get('errors')]
+                for name, sheet in sheets.items()
+            },
+        ],
+        option=_SIGNATURE_OPTIONS
+    )))
+
+
+# Признаки перегрузки WB (429, 5xx, таймауты): только они замедляют темп запросов.
+# Остальные ошибки (4xx клиента, нет данных парсинга, отмена при остановке) темп не меняют
+_OVERLOAD_ERROR = re.compile(r'HTTP (?:429|5\d\d)|Timeout')
+
+
+class _TokenBucket:
+    """
+    Token bucket для темпа запросов: токены копятся со скоростью rate в секунду, но не больше capacity.
+    
+    Запрос забирает токен в момент отправки, поэтому время самого запроса входит в интервал
+    и темп не уплывает при медленных ответах.
+    """
+    
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+    
+    def set_rate(self, rate: float):
+        """Меняет скорость: накопленное до этого момента начисляется по старой скорости"""
+        self._refill()
+        self.rate = rate
+    
+    def time_until_token(self) -> float:
+        """Сколько секунд ждать до появления целого токена (0 - можно отправлять)"""
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+    
+    def consume(self):
+        """Забирает токен; при раннем пробуждении уходит в небольшой долг, который учтется в следующей паузе"""
+        self._refill()
+        self._tokens -= 1
+
 
 class WBSlotsMonitor:
-    def __init__(self, update_interval: int = 300, telegram_notifier=None):  # 5 минут по умолчанию
+    def __init__(self, update_interval: int = 300, telegram_notifier=None,  # 5 минут по умолчанию
+                 sheet_cache_ttl: int = 0, quiet: bool = False):
         self.update_interval = update_interval
         self.sheets_parser = create_parser_from_env()
         self.wb_monitor = WBMonitor()
         self.last_update = None
         self.cycle_count = 0
         self.telegram_notifier = telegram_notifier
+        # Отчет формируется и пишется в консоль одной записью в отдельном потоке (задачи отчетов идут
+        # через очередь executor'а по порядку), event loop в это время обслуживает Telegram
+        self._display_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='wb-display')
+        
+        # Уведомления в Telegram отправляет фоновая задача: медленный Telegram не задерживает циклы WB.
+        # В очереди только последнее состояние - устаревшее заменяется новым
+        self._notify_queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        
+        # Отпечаток последних показанных результатов: одинаковый отчет в консоль повторно не выводим
+        self._last_results_signature: Optional[int] = None
+        self._last_results_changed_at: Optional[datetime] = None
+        self._telegram_worker_task: Optional[asyncio.Task] = None
         
         # Настройки для оптимизации API запросов
         self.api_requests_per_minute = 6  # Каждый endpoint имеет свой лимит 6/минуту
-        self.api_pause_between_requests = 4  # начальная пауза между API циклами
+        self.api_pause_between_requests = 4  # минимальная пауза перед повтором после ошибки
         self.current_api_requests = 0
+        self.rate_limit_remaining_threshold = 2  # При таком остатке лимита WB переходим на равномерный темп
         self.parsed_data = None  # Кешируем данные парсинга
+        # Производные parsed_data, которые не меняются до следующего парсинга:
+        # {'parsed_data': исходный dict, 'products': CompiledProducts, 'sheets_json': bytes}
+        self._compiled: Optional[Dict[str, Any]] = None
+        self._parsed_for_series = False  # Парсинг текущей серии уже выполнен (при ошибке API не повторяем его)
+        self._pending_parse: Optional[asyncio.Task] = None  # Парсинг следующей серии, запущенный во время паузы
+        
+        # Кеш парсинга Google таблиц: переиспользуется, пока таблица не менялась и не истек TTL (0 - выключен)
+        self.sheet_cache_ttl = sheet_cache_ttl
+        
+        # Без подробного отчета в консоли (headless запуск): печатается только сводка
+        self.quiet = quiet
+        self._sheets_cache: Optional[Dict[str, Any]] = None  # {'revision', 'parsed_data', 'cached_at'}
         
-        # Адаптивные тайминги
-        self.minute_start_time = None  # Время начала минутного цикла
-        self.api_execution_times = []  # История времени выполнения API запросов
+        # Темп API запросов: api_requests_per_minute за target_minute_duration секунд, без запаса на всплеск
         self.target_minute_duration = 60  # Целевая длительность минуты в секундах
+        self.api_limiter = _TokenBucket(self.api_requests_per_minute / self.target_minute_duration)
+        
+        # AIMD: при 429/5xx/таймаутах темп падает вдвое, на чистых ответах растет на 0.5 запроса в минуту
+        self._effective_rpm = float(self.api_requests_per_minute)
+        self._ema_api_time = 0.0  # Сглаженное время успешных API запросов (EMA, alpha = 0.5)
+        self.target_api_latency = 2.0  # Средняя задержка в секундах, при которой WB считается ненагруженным
         
     def format_datetime(self, dt_str: str) -> str:
         """Форматирует дату для красивого вывода"""
-        try:
-            dt = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-            return dt.strftime('%d.%m %H:%M')
-        except:
-            return dt_str
+        return format_dt(dt_str)
     
     def print_separator(self, char: str = "=", length: int = 80):
         """Печатает разделитель"""
@@ -52,166 +159,164 @@ class WBSlotsMonitor:
         print(f" {text}")
         self.print_separator()
     
-    def calculate_adaptive_pause(self, api_execution_time: float) -> float:
+    def calculate_rate_limit_pause(self, rate_headers: Optional[Dict[str, Dict[str, str]]]) -> float:
         """
-        Рассчитывает адаптивную паузу на основе времени выполнения API запросов
+        Рассчитывает минимальную паузу по заголовкам лимитов WB
         
         Args:
-            api_execution_time: Время выполнения последнего API запроса
+            rate_headers: Заголовки лимитов последних ответов {endpoint: {заголовок: значение}}
             
         Returns:
-            Рекомендованная пауза в секундах
+            Пауза в секундах (0 - заголовки не ограничивают)
         """
-        # Добавляем время последнего запроса в историю
-        self.api_execution_times.append(api_execution_time)
-        
-        # Оставляем только последние 10 измерений для расчета среднего
-        if len(self.api_execution_times) > 10:
-            self.api_execution_times = self.api_execution_times[-10:]
-        
-        # Рассчитываем среднее время выполнения API запроса
-        avg_api_time = sum(self.api_execution_times) / len(self.api_execution_times)
-        
-        # Определяем, сколько API запросов осталось до конца цикла
-        remaining_requests = self.api_requests_per_minute - self.current_api_requests
-        
-        if remaining_requests <= 0:
-            # Если это последний запрос в цикле, возвращаем время до начала новой минуты
-            if self.minute_start_time:
-                elapsed_time = time.time() - self.minute_start_time
-                remaining_time = max(0, self.target_minute_duration - elapsed_time)
-                return remaining_time
-            return self.target_minute_duration
-        
-        # Рассчитываем оставшееся время в минуте
-        if self.minute_start_time:
-            elapsed_time = time.time() - self.minute_start_time
-            remaining_time = max(0, self.target_minute_duration - elapsed_time)
-        else:
-            # Если это первый запрос, считаем что у нас есть вся минута
-            remaining_time = self.target_minute_duration
+        pause = 0.0
+        for headers in (rate_headers or {}).values():
+            try:
+                retry_after = headers.get('X-Ratelimit-Retry') or headers.get('Retry-After')
+                if retry_after:
+                    pause = max(pause, float(retry_after))
+                    continue
+                
+                remaining = headers.get('X-Ratelimit-Remaining')
+                if remaining is not None and int(remaining) <= self.rate_limit_remaining_threshold:
+                    pause = max(pause, 60 / self.api_requests_per_minute)
+            except ValueError:
+                continue
         
-        # Вычисляем время, которое потратим на оставшиеся API запросы
-        estimated_api_time = remaining_requests * avg_api_time
+        return pause
+    
+    def update_effective_rpm(self, api_result: Dict[str, Any]):
+        """
+        Корректирует темп API запросов по результату последнего запроса (AIMD)
         
-        # Вычисляем общее время на паузы
-        total_pause_time = remaining_time - estimated_api_time
+        Темп растет и EMA задержки обновляется только на полностью успешных ответах WB.
+        429/5xx/таймауты снижают темп вдвое, остальные ошибки его не меняют.
+        """
+        previous_rpm = self._effective_rpm
+        
+        if api_result['success']:
+            api_time = api_result['api_time']
+            self._ema_api_time = 0.5 * api_time + 0.5 * self._ema_api_time if self._ema_api_time else api_time
+            if self._ema_api_time <= self.target_api_latency:
+                self._effective_rpm = min(float(self.api_requests_per_minute), self._effective_rpm + 0.5)
+        elif _OVERLOAD_ERROR.search(api_result.get('error') or ''):
+            self._effective_rpm = max(1.0, self._effective_rpm * 0.5)
+        
+        if self._effective_rpm != previous_rpm:
+            self.api_limiter.set_rate(self._effective_rpm / self.target_minute_duration)
+            print(f"🎚️  Темп API запросов: {previous_rpm:.1f} → {self._effective_rpm:.1f} в минуту")
+    
+    def calculate_next_pause(self, rate_headers: Optional[Dict[str, Dict[str, str]]] = None) -> float:
+        """
+        Рассчитывает паузу до следующего API запроса
         
-        # Распределяем паузы равномерно между оставшимися запросами
-        if remaining_requests > 0:
-            adaptive_pause = max(1, total_pause_time / remaining_requests)  # Минимум 1 секунда
-        else:
-            adaptive_pause = self.api_pause_between_requests
+        Args:
+            rate_headers: Заголовки лимитов WB из последнего API запроса
+            
+        Returns:
+            Пауза в секундах: до следующего токена лимитера, но не меньше, чем просят заголовки WB
+        """
+        pause = self.api_limiter.time_until_token()
         
-        # Ограничиваем максимальную паузу
-        adaptive_pause = min(adaptive_pause, 30)  # Максимум 30 секунд
+        rate_limit_pause = self.calculate_rate_limit_pause(rate_headers)
+        if rate_limit_pause > pause:
+            print(f"🚦 Лимит WB API почти исчерпан: пауза увеличена до {rate_limit_pause:.1f}с")
+            return rate_limit_pause
         
-        return adaptive_pause
-    
-    def reset_minute_cycle(self):
-        """Сбрасывает счетчики для нового минутного цикла"""
-        self.minute_start_time = time.time()
-        self.current_api_requests = 0
-        print(f"🔄 Начат новый минутный цикл: {datetime.now().strftime('%H:%M:%S')}")
-    
-    def log_adaptive_timing(self, api_time: float, adaptive_pause: float):
-        """Логирует информацию об адаптивных таймингах"""
-        if len(self.api_execution_times) > 1:
-            avg_api_time = sum(self.api_execution_times) / len(self.api_execution_times)
-            print(f"📊 Среднее время API: {avg_api_time:.2f}с")
-        
-        remaining_requests = self.api_requests_per_minute - self.current_api_requests
-        print(f"⏱️  Адаптивная пауза: {adaptive_pause:.1f}с (осталось {remaining_requests} запросов)")
-        
-        if self.minute_start_time:
-            elapsed_time = time.time() - self.minute_start_time
-            remaining_minute_time = max(0, self.target_minute_duration - elapsed_time)
-            print(f"⏰ Время в текущей минуте: {elapsed_time:.1f}с / {self.target_minute_duration}с (осталось: {remaining_minute_time:.1f}с)")
+        return pause
     
     def display_monitoring_results(self, parsed_data: Dict[str, Any], monitoring_results: Dict[str, Any]):
         """Выводит результаты мониторинга в консоль"""
+        if self.quiet:
+            summary = monitoring_results.get('summary', {})
+            status = "✅" if monitoring_results.get('success') else "❌"
+            print(f"{status} Мониторинг: листов {summary.get('total_sheets', 0)}, "
+                  f"слотов {summary.get('total_available_slots', 0)}")
+            return
+        
+        # Отчет собираем в буфер и выводим одной записью
+        out = io.StringIO()
+        self._write_monitoring_results(out, parsed_data, monitoring_results)
+        sys.stdout.write(out.getvalue())
+        sys.stdout.flush()
+    
+    def _write_monitoring_results(self, out: io.StringIO, parsed_data: Dict[str, Any], monitoring_results: Dict[str, Any]):
+        """Записывает отчет мониторинга в буфер"""
         
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.print_header(f"МОНИТОРИНГ СЛОТОВ WB - {timestamp}")
+        separator = "=" * 80
+        out.write(f"{separator}\n МОНИТОРИНГ СЛОТОВ WB - {timestamp}\n{separator}\n")
         
         if not monitoring_results.get('success'):
-            print(f"❌ ОШИБКА МОНИТОРИНГА: {monitoring_results.get('error', 'Неизвестная ошибка')}")
+            out.write(f"❌ ОШИБКА МОНИТОРИНГА: {monitoring_results.get('error', 'Неизвестная ошибка')}\n")
             return
         
         summary = monitoring_results.get('summary', {})
-        print(f"📊 Обработано листов: {summary.get('total_sheets', 0)}")
-        print(f"✅ Листов с доступными слотами: {summary.get('sheets_with_slots', 0)}")
-        print(f"🎯 Всего найдено слотов: {summary.get('total_available_slots', 0)}")
-        print()
+        out.write(f"📊 Обработано листов: {summary.get('total_sheets', 0)}\n")
+        out.write(f"✅ Листов с доступными слотами: {summary.get('sheets_with_slots', 0)}\n")
+        out.write(f"🎯 Всего найдено слотов: {summary.get('total_available_slots', 0)}\n")
+        out.write("\n")
         
         # Обрабатываем каждый лист
         for sheet_name, sheet_data in parsed_data.get('sheets', {}).items():
             monitoring_data = monitoring_results.get('sheets', {}).get(sheet_name, {})
             
-            print(f"📋 ЛИСТ: {sheet_name}")
-            print(f"📅 Период: {sheet_data.get('start_date', 'N/A')} - {sheet_data.get('end_date', 'N/A')}")
+            out.write(f"📋 ЛИСТ: {sheet_name}\n")
+            out.write(f"📅 Период: {sheet_data.get('start_date', 'N/A')} - {sheet_data.get('end_date', 'N/A')}\n")
             
             # Показываем ошибки, если есть
             errors = monitoring_data.get('errors', [])
             if errors:
-                print(f"⚠️  Ошибки: {'; '.join(errors)}")
+                out.write(f"⚠️  Ошибки: {'; '.join(errors)}\n")
             
             # Обрабатываем товары
             products = sheet_data.get('products', [])
-            available_slots = monitoring_data.get('available_slots', [])
             warehouse_ids = monitoring_data.get('warehouse_ids', {})
-            available_options = monitoring_data.get('available_options', {})
+            options_by_barcode = monitoring_data.get('options_by_barcode', {})
             
             if not products:
-                print("   Нет товаров для мониторинга")
-                print()
+                out.write("   Нет товаров для мониторинга\n")
+                out.write("\n")
                 continue
             
+            # Индекс слотов склад -> тип упаковки -> (позиция на складе, слот): товару нужны только его упаковки.
+            # Позиция сохраняет исходный порядок слотов при слиянии списков упаковок
+            slots_by_box = {}
+            for warehouse_id, slots in monitoring_data.get('slots_by_warehouse', {}).items():
+                warehouse_box_slots = slots_by_box[warehouse_id] = defaultdict(list)
+                for position, slot in enumerate(slots):
+                    warehouse_box_slots[slot['box_type']].append((position, slot))
+            
             # Группируем данные для удобного отображения
-            self.display_products_analysis(products, available_slots, warehouse_ids, available_options)
-            print()
+            self.display_products_analysis(out, products, slots_by_box, warehouse_ids, options_by_barcode)
+            out.write("\n")
     
-    def display_products_analysis(self, products: List[Dict], available_slots: List[Dict], 
-                                warehouse_ids: Dict[str, int], available_options: Dict[str, Any]):
-        """Отображает анализ товаров с группировкой по баркодам"""
-        
-        # Создаем словарь опций по баркодам
-        options_by_barcode = {}
-        if available_options and 'result' in available_options:
-            for item in available_options['result']:
-                barcode = item.get('barcode', '')
-                options_by_barcode[barcode] = item
-        
-        # Создаем словарь слотов по складам
-        slots_by_warehouse = {}
-        for slot in available_slots:
-            warehouse_id = slot['warehouse_id']
-            if warehouse_id not in slots_by_warehouse:
-                slots_by_warehouse[warehouse_id] = []
-            slots_by_warehouse[warehouse_id].append(slot)
+    def display_products_analysis(self, out: io.StringIO, products: List[Dict], slots_by_box: Dict[int, Dict[str, List[Tuple[int, Dict]]]],
+                                warehouse_ids: Dict[str, int], options_by_barcode: Dict[str, Dict[str, Any]]):
+        """Записывает в буфер анализ товаров с группировкой по баркодам"""
         
         # Обрабатываем каждый товар
         for product in products:
             barcode = product['barcode']
             quantity = product['quantity']
             
-            print(f"📦 БАРКОД: {barcode} (Количество: {quantity})")
+            out.write(f"📦 БАРКОД: {barcode} (Количество: {quantity})\n")
             
             # Проверяем опции приемки для этого баркода
             barcode_options = options_by_barcode.get(barcode)
             
             if not barcode_options:
-                print("   ❌ Нет данных об опциях приемки")
+                out.write("   ❌ Нет данных об опциях приемки\n")
                 continue
             
             if barcode_options.get('isError'):
                 error = barcode_options.get('error', {})
-                print(f"   ❌ ОШИБКА: {error.get('title', 'Unknown')} - {error.get('detail', 'No details')}")
+                out.write(f"   ❌ ОШИБКА: {error.get('title', 'Unknown')} - {error.get('detail', 'No details')}\n")
                 continue
             
             warehouses_for_barcode = barcode_options.get('warehouses', [])
             if not warehouses_for_barcode:
-                print("   ❌ Нет доступных складов для этого товара")
+                out.write("   ❌ Нет доступных складов для этого товара\n")
                 continue
             
             # Отображаем информацию по каждому доступному складу
@@ -221,106 +326,132 @@ class WBSlotsMonitor:
                 warehouse_id = warehouse_option['warehouseID']
                 
                 # Проверяем, есть ли этот склад в наших слотах
-                warehouse_slots = slots_by_warehouse.get(warehouse_id, [])
+                warehouse_box_slots = slots_by_box.get(warehouse_id)
                 
-                if not warehouse_slots:
+                if not warehouse_box_slots:
                     continue  # Пропускаем склады без доступных слотов
                 
-                warehouse_name = warehouse_slots[0]['warehouse_name']  # Берем название из слотов
-                
                 # Определяем доступные упаковки для товара на этом складе
-                available_packaging = {}
-                if warehouse_option.get('canBox'):
-                    available_packaging['Короба'] = '📦'
-                if warehouse_option.get('canMonopallet'):
-                    available_packaging['Монопаллеты'] = '🚛'
-                if warehouse_option.get('canSupersafe'):
-                    available_packaging['Суперсейф'] = '🔒'
+                available_packaging = {
+                    name: emoji for flag, name, emoji in PACKAGING_EMOJI if warehouse_option.get(flag)
+                }
                 
-                # Фильтруем слоты только по доступным упаковкам
-                filtered_slots = []
-                for slot in warehouse_slots:
-                    if slot['box_type'] in available_packaging:
-                        filtered_slots.append(slot)
+                # Берем слоты только доступных упаковок - по одному обращению к индексу на упаковку
+                box_slot_lists = [
+                    warehouse_box_slots[box_type] for box_type in available_packaging if box_type in warehouse_box_slots
+                ]
                 
-                if not filtered_slots:
+                if not box_slot_lists:
                     continue  # Пропускаем склады без подходящих слотов
                 
+                # Слоты склада уже отсортированы по дате, поэтому списки упаковок сливаем по позиции на складе:
+                # порядок дат сохраняется, а слоты одной даты идут в исходном порядке ответа API
+                if len(box_slot_lists) == 1:
+                    filtered_slots = [slot for _, slot in box_slot_lists[0]]
+                else:
+                    filtered_slots = [slot for _, slot in heapq.merge(*box_slot_lists)]
+                
+                warehouse_name = filtered_slots[0]['warehouse_name']  # Берем название из слотов
                 has_available_warehouses = True
-                print(f"   🏪 {warehouse_name} (ID: {warehouse_id})")
+                out.write(f"   🏪 {warehouse_name} (ID: {warehouse_id})\n")
                 
                 # Показываем доступные упаковки
                 if available_packaging:
-                    packaging_list = [f"{emoji} {name}" for name, emoji in available_packaging.items()]
-                    print(f"      Упаковки: {', '.join(packaging_list)}")
+                    out.write(f"      Упаковки: {', '.join(map(_PACKAGING_LABELS.__getitem__, available_packaging))}\n")
                 else:
-                    print("      ❌ Нет доступных упаковок")
+                    out.write("      ❌ Нет доступных упаковок\n")
                 
                 # Показываем только подходящие слоты
-                print("      📅 Доступные слоты:")
+                out.write("      📅 Доступные слоты:\n")
                 
                 # Группируем отфильтрованные слоты по дате
-                slots_by_date = {}
-                for slot in filtered_slots:
-                    date = slot['date']
-                    if date not in slots_by_date:
-                        slots_by_date[date] = []
-                    slots_by_date[date].append(slot)
-                
-                # Сортируем даты
-                sorted_dates = sorted(slots_by_date.keys())
-                
-                if not sorted_dates:
-                    print("         ❌ Нет подходящих слотов")
-                else:
-                    for date in sorted_dates:
-                        date_slots = slots_by_date[date]
-                        formatted_date = self.format_datetime(date)
+                for date, date_slots in groupby(filtered_slots, key=_slot_date):
+                    date_prefix = f"         {self.format_datetime(date)} ("
+                    
+                    for slot in date_slots:
+                        coefficient = slot['coefficient']
                         
-                        for slot in date_slots:
-                            coefficient = slot['coefficient']
-                            box_type = slot['box_type']
-                            
-                            if coefficient == 0:
-                                cost_info = "🆓 Бесплатно"
-                            else:
-                                cost_info = f"💰 Множитель: {coefficient}"
-                            
-                            print(f"         {formatted_date} ({box_type}): {cost_info}")
+                        if coefficient == 0:
+                            cost_info = _FREE_SLOT
+                        else:
+                            cost_info = f"{_MULTIPLIER_PREFIX}{coefficient}"
+                        
+                        out.write(f"{date_prefix}{slot['box_type']}): {cost_info}\n")
                 
-                print()  # Пустая строка между складами
+                out.write("\n")  # Пустая строка между складами
             
             if not has_available_warehouses:
-                print("   ❌ Нет доступных складов с открытыми слотами")
+                out.write("   ❌ Нет доступных складов с открытыми слотами\n")
             
-            print("-" * 60)  # Разделитель между товарами
+            out.write("-" * 60 + "\n")  # Разделитель между товарами
     
-    def run_parsing_cycle(self) -> Dict[str, Any]:
-        """Выполняет парсинг Google таблиц"""
-        parse_start = time.time()
+    def get_sheets_revision(self) -> Optional[str]:
+        """Возвращает ревизию таблицы для кеша парсинга или None, если кеш выключен/ревизия недоступна"""
+        if self.sheet_cache_ttl <= 0:
+            return None
         
         try:
+            return self.sheets_parser.get_revision()
+        except Exception as e:
+            print(f"⚠️  Не удалось получить ревизию таблицы, выполняем полный парсинг: {e}")
+            return None
+    
+    def run_parsing_cycle(self, sheets_cache: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Выполняет парсинг Google таблиц
+        
+        Работает в отдельном потоке, поэтому состояние монитора не меняет: новые данные ('parsed_data')
+        и кеш парсинга ('sheets_cache') возвращаются в результате, их применяет _apply_parse_result.
+        
+        Args:
+            sheets_cache: Текущий кеш парсинга (None - кеша нет)
+        """
+        parse_start = time.monotonic()
+        
+        try:
+            revision = self.get_sheets_revision()
+            cache = sheets_cache
+            if (revision is not None and cache and cache['revision'] == revision
+                    and time.monotonic() - cache['cached_at'] < self.sheet_cache_ttl):
+                parse_time = time.monotonic() - parse_start
+                print(f"♻️  Таблица не менялась, используем предыдущий парсинг (проверка за {parse_time:.2f}с)")
+                return {
+                    'success': True,
+                    'parse_time': parse_time,
+                    'parsed_data': cache['parsed_data']
+                }
+            
             print("🔄 Парсинг Google таблиц...")
             
             # Получаем данные в формате словаря {sheet_name: SheetsData}
             sheets_data = self.sheets_parser.parse_all_sheets()
             
             # Преобразуем в нужный формат
-            self.parsed_data = self.sheets_parser.to_dict(sheets_data)
+            parsed_data = self.sheets_parser.to_dict(sheets_data)
+            
+            parse_time = time.monotonic() - parse_start
             
-            parse_time = time.time() - parse_start
+            # Неполный парсинг не кешируем: упавшие листы перечитаются на следующем цикле
+            if revision is not None and parsed_data.get('sheets') and not self.sheets_parser.failed_sheets:
+                sheets_cache = {
+                    'revision': revision,
+                    'parsed_data': parsed_data,
+                    'cached_at': time.monotonic()
+                }
             
-            if not self.parsed_data.get('sheets'):
+            if not parsed_data.get('sheets'):
                 return {
                     'success': False,
                     'error': 'Не удалось получить данные из Google таблиц',
-                    'parse_time': parse_time
+                    'parse_time': parse_time,
+                    'parsed_data': parsed_data,
+                    'sheets_cache': sheets_cache
                 }
             
-            sheets_count = len(self.parsed_data['sheets'])
-            total_products = sum(len(sheet.get('products', [])) for sheet in self.parsed_data['sheets'].values())
+            sheets_count = len(parsed_data['sheets'])
+            total_products = sum(len(sheet.get('products', [])) for sheet in parsed_data['sheets'].values())
             
-            google_requests = self.parsed_data.get('google_api_requests', 0)
+            google_requests = parsed_data.get('google_api_requests', 0)
             print(f"✅ Парсинг завершен за {parse_time:.2f}с. Найдено листов: {sheets_count}, товаров: {total_products}")
             print(f"📊 Google Sheets API запросов: {google_requests} (лимит: 60/мин)")
             print(f"🚀 Оптимизация: Будет выполнено ровно 3 API запроса (склады + коэффициенты + все товары)")
@@ -328,17 +459,68 @@ class WBSlotsMonitor:
             
             return {
                 'success': True,
-                'parse_time': parse_time
+                'parse_time': parse_time,
+                'parsed_data': parsed_data,
+                'sheets_cache': sheets_cache
             }
             
         except Exception as e:
-            parse_time = time.time() - parse_start
+            parse_time = time.monotonic() - parse_start
             return {
                 'success': False,
                 'error': str(e),
-                'parse_time': parse_time
+                'parse_time': parse_time,
+                'sheets_cache': None  # После ошибки парсера не доверяем сохраненному результату
             }
     
+    def _apply_parse_result(self, parse_result: Dict[str, Any]):
+        """Применяет результат парсинга к состоянию монитора (вызывается в event loop после await)"""
+        if 'parsed_data' in parse_result:
+            self.parsed_data = parse_result.pop('parsed_data')
+        if 'sheets_cache' in parse_result:
+            self._sheets_cache = parse_result.pop('sheets_cache')
+    
+    def _get_compiled(self) -> Dict[str, Any]:
+        """Возвращает подготовленные производные self.parsed_data, пересобирая их только после нового парсинга"""
+        if self._compiled is None or self._compiled['parsed_data'] is not self.parsed_data:
+            self._compiled = {
+                'parsed_data': self.parsed_data,
+                'products': self.wb_monitor.compile_parsed_data(self.parsed_data),
+                'sheets_json': orjson.dumps(self.parsed_data.get('sheets'), option=_SIGNATURE_OPTIONS),
+            }
+        return self._compiled
+    
+    async def _send_telegram_notification(self, parsed_data: Dict[str, Any], monitoring_results: Dict[str, Any],
+                                          signature: Optional[int] = None):
+        """Отправляет уведомление в Telegram, ошибки только логируются"""
+        try:
+            await self.telegram_notifier.send_notification(parsed_data, monitoring_results, signature)
+        except Exception as e:
+            print(f"⚠️  Ошибка отправки Telegram уведомления: {e}")
+    
+    def _enqueue_notification(self, parsed_data: Dict[str, Any], monitoring_results: Dict[str, Any],
+                              signature: Optional[int] = None):
+        """Ставит уведомление в очередь, вытесняя еще не отправленное устаревшее"""
+        item = (parsed_data, monitoring_results, signature)
+        try:
+            self._notify_queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._notify_queue.get_nowait()
+            self._notify_queue.put_nowait(item)
+    
+    async def _telegram_worker(self):
+        """Фоновая отправка уведомлений из очереди"""
+        while True:
+            parsed_data, monitoring_results, signature = await self._notify_queue.get()
+            await self._send_telegram_notification(parsed_data, monitoring_results, signature)
+    
+    async def _parse_async(self) -> Dict[str, Any]:
+        """
+        Выполняет парсинг Google таблиц в отдельном потоке, не блокируя event loop.
+        Результат не применяется: это делает вызывающий код через _apply_parse_result
+        """
+        return await asyncio.to_thread(self.run_parsing_cycle, self._sheets_cache)
+    
     async def run_api_request(self) -> Dict[str, Any]:
         """Выполняет один API запрос с проверкой остановки"""
         if not self.parsed_data:
@@ -348,60 +530,71 @@ class WBSlotsMonitor:
                 'api_time': 0
             }
         
-        api_start = time.time()
+        api_start = time.monotonic()
         
         try:
             print(f"🔄 API запрос #{self.current_api_requests + 1}/6...")
+            self.api_limiter.consume()
             
-            # Сохраняем parsed_data во временный файл для WBMonitor
-            temp_file = 'temp_parsed_data.json'
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(self.parsed_data, f, ensure_ascii=False, indent=2)
+            # Запросы к WB выполняются асинхронно и параллельно, отмена задачи прерывает их сразу.
+            # Данные парсинга передаем напрямую, без промежуточного JSON файла,
+            # товары для запроса опций подготовлены один раз на парсинг
+            compiled = self._get_compiled()
+            monitoring_results = await self.wb_monitor.monitor_parsed_dict_async(
+                self.parsed_data, compiled=compiled['products']
+            )
             
-            try:
-                # Выполняем API запрос в executor чтобы он был прерываемым
-                loop = asyncio.get_event_loop()
-                monitoring_results = await loop.run_in_executor(
-                    None, 
-                    self.wb_monitor.monitor_parsed_data, 
-                    temp_file
-                )
-            finally:
-                # Удаляем временный файл
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-            
-            api_time = time.time() - api_start
+            api_time = time.monotonic() - api_start
             self.current_api_requests += 1
             
             print(f"✅ API запрос завершен за {api_time:.2f}с")
             
-            # Отображение результатов
-            self.display_monitoring_results(self.parsed_data, monitoring_results)
+            signature = _results_signature(compiled['sheets_json'], monitoring_results)
+            unchanged = monitoring_results.get('success') and signature == self._last_results_signature
+            self._last_results_signature = signature
+            
+            if unchanged:
+                print(f"📡 Без изменений с {self._last_results_changed_at.strftime('%H:%M:%S')}")
+                display_future = None
+            else:
+                self._last_results_changed_at = datetime.now()
+                # Отображение результатов идет в отдельном потоке параллельно с Telegram:
+                # оба только читают результаты, а вывод в консоль дожидаемся до конца цикла
+                display_future = asyncio.get_running_loop().run_in_executor(
+                    self._display_executor, self.display_monitoring_results, self.parsed_data, monitoring_results
+                )
             
             # Отправляем уведомление в Telegram если есть telegram_notifier
-            if self.telegram_notifier:
-                try:
-                    await self.telegram_notifier.send_notification(self.parsed_data, monitoring_results)
-                except Exception as e:
-                    print(f"⚠️  Ошибка отправки Telegram уведомления: {e}")
+            try:
+                if self.telegram_notifier:
+                    if self._telegram_worker_task is not None:
+                        self._enqueue_notification(self.parsed_data, monitoring_results, signature)
+                    else:
+                        # Без фоновой задачи (одиночный цикл) отправляем сразу
+                        await self._send_telegram_notification(self.parsed_data, monitoring_results, signature)
+            finally:
+                if display_future is not None:
+                    await display_future
             
+            # Ошибки запросов к WB не выбрасываются, а приходят в результатах мониторинга
             return {
-                'success': True,
+                'success': monitoring_results['success'],
+                'error': monitoring_results.get('error'),
                 'monitoring_results': monitoring_results,
-                'api_time': api_time
+                'api_time': api_time,
+                'rate_headers': self.wb_monitor.get_rate_headers()
             }
             
         except asyncio.CancelledError:
             print("🛑 API запрос отменен")
-            api_time = time.time() - api_start
+            api_time = time.monotonic() - api_start
             return {
                 'success': False,
                 'error': 'API запрос отменен',
                 'api_time': api_time
             }
         except Exception as e:
-            api_time = time.time() - api_start
+            api_time = time.monotonic() - api_start
             return {
                 'success': False,
                 'error': str(e),
@@ -410,21 +603,30 @@ class WBSlotsMonitor:
     
     async def run_optimized_cycle(self) -> Dict[str, Any]:
         """Выполняет оптимизированный цикл: парсинг + API запрос"""
-        cycle_start_time = time.time()
-        
-        # 1. Парсинг (только если начинаем новый минутный цикл)
-        if self.current_api_requests == 0:
-            # Начинаем новый минутный цикл
-            self.reset_minute_cycle()
-            
-            parse_result = self.run_parsing_cycle()
+        cycle_start_time = time.monotonic()
+        
+        # 1. Парсинг (только если начинаем новый минутный цикл и еще не парсили его таблицы)
+        if self.current_api_requests == 0 and not self._parsed_for_series:
+            # Начинаем новую серию API запросов
+            self.current_api_requests = 0
+            print(f"🔄 Начата новая серия запросов: {datetime.now().strftime('%H:%M:%S')}")
+            
+            if self._pending_parse is not None:
+                # Таблицы уже парсились в фоне во время паузы после прошлой серии
+                parse_task, self._pending_parse = self._pending_parse, None
+                parse_result = await parse_task
+            else:
+                parse_result = await self._parse_async()
+            # Данные парсинга меняем только здесь, в event loop, когда поток парсинга уже завершился
+            self._apply_parse_result(parse_result)
+            self._parsed_for_series = parse_result['success']
             if not parse_result['success']:
                 return {
                     'success': False,
                     'error': parse_result['error'],
                     'parse_time': parse_result['parse_time'],
                     'api_time': 0,
-                    'total_time': time.time() - cycle_start_time,
+                    'total_time': time.monotonic() - cycle_start_time,
                     'cycle_type': 'parse_failed'
                 }
         else:
@@ -432,8 +634,9 @@ class WBSlotsMonitor:
         
         # 2. API запрос
         api_result = await self.run_api_request()
+        self.update_effective_rpm(api_result)
         
-        total_time = time.time() - cycle_start_time
+        total_time = time.monotonic() - cycle_start_time
         
         # Определяем тип цикла и сбрасываем счетчик если нужно
         if self.current_api_requests == 1:
@@ -443,12 +646,17 @@ class WBSlotsMonitor:
         else:
             cycle_type = 'api_final'  # Последний API в серии
             self.current_api_requests = 0  # Сбрасываем счетчик для следующего минутного цикла
+            self._parsed_for_series = False
+            
+            # Парсинг следующей серии идет в фоне, пока ждем паузу перед ее первым запросом
+            self._pending_parse = asyncio.create_task(self._parse_async())
         
         return {
             'success': api_result['success'],
             'error': api_result.get('error'),
             'parse_time': parse_result['parse_time'],
             'api_time': api_result['api_time'],
+            'rate_headers': api_result.get('rate_headers'),
             'total_time': total_time,
             'cycle_type': cycle_type,
             'api_requests_count': self.current_api_requests if cycle_type != 'api_final' else self.api_requests_per_minute
@@ -458,12 +666,17 @@ class WBSlotsMonitor:
         """Запускает оптимизированный непрерывный мониторинг"""
         print("🚀 Запуск АДАПТИВНОГО мониторинга WB слотов")
         print(f"🎯 ОПТИМИЗАЦИЯ: Точно 3 API запроса за цикл (склады + коэффициенты + все товары)")
-        print(f"🧠 АДАПТИВНЫЕ ПАУЗЫ: Динамический расчет пауз на основе реального времени API")
-        print(f"📋 Стратегия: Парсинг + API → адаптивная пауза → API → адаптивная пауза → повтор")
+        print(f"🧠 ТЕМП: Token bucket - запросы равномерно, время ответа API входит в интервал")
+        print(f"📋 Стратегия: Парсинг + API → пауза до токена → API → пауза до токена → повтор")
         print(f"⚡ Лимит WB: {self.api_requests_per_minute} запросов/минуту для КАЖДОГО endpoint'а")
         print(f"🎯 Цель: {self.api_requests_per_minute} циклов ровно за {self.target_minute_duration} секунд")
         self.print_separator()
         
+        # Одна задача ожидания остановки на весь мониторинг - паузы ждут ее через asyncio.wait с таймаутом
+        shutdown_waiter = asyncio.create_task(shutdown_event.wait()) if shutdown_event else None
+        if self.telegram_notifier:
+            self._telegram_worker_task = asyncio.create_task(self._telegram_worker())
+        
         try:
             while True:
                 # Проверяем флаг остановки перед каждым циклом
@@ -494,13 +707,11 @@ class WBSlotsMonitor:
                         print(f"   📊 Парсинг таблиц: {result['parse_time']:.2f}с")
                     print(f"   🌐 API запрос: {result['api_time']:.2f}с")
                     print(f"   ⚡ Общее время: {result['total_time']:.2f}с")
+                    print(f"   📈 Среднее время API: {self._ema_api_time:.2f}с")
                     
                     # Сохраняем последнее успешное обновление
                     self.last_update = datetime.now()
                     
-                    # Рассчитываем адаптивную паузу
-                    adaptive_pause = self.calculate_adaptive_pause(result['api_time'])
-                    
                     # Определяем следующую паузу и действие
                     if cycle_type == 'api_final':
                         next_action = "новый цикл с парсингом"
@@ -508,34 +719,37 @@ class WBSlotsMonitor:
                     else:
                         next_action = f"API запрос #{result.get('api_requests_count', 0) + 1}"
                     
-                    # Логируем адаптивные тайминги
-                    self.log_adaptive_timing(result['api_time'], adaptive_pause)
-                    next_pause = adaptive_pause
+                    next_pause = self.calculate_next_pause(result.get('rate_headers'))
                         
                 else:
                     print(f"\n❌ ОШИБКА ЦИКЛА: {result['error']}")
                     print(f"⏱️  Время до ошибки: {result['total_time']:.2f}с")
-                    next_pause = self.api_pause_between_requests
+                    if result['parse_time'] > 0:
+                        print(f"   📊 Парсинг таблиц: {result['parse_time']:.2f}с")
+                    if result['api_time'] > 0:
+                        print(f"   🌐 API запрос: {result['api_time']:.2f}с")
+                    next_pause = max(self.api_pause_between_requests, self.calculate_next_pause(result.get('rate_headers')))
                     next_action = "повтор"
                 
-                # Ждем до следующего действия с проверкой shutdown
-                print(f"\n😴 Адаптивная пауза {next_pause:.1f}с до: {next_action}")
+                # Ждем до следующего действия с проверкой shutdown.
+                # Пауза отсчитывается от этого момента, время на вывод логов в нее входит
+                next_action_at = time.monotonic() + next_pause
+                print(f"\n😴 Пауза {next_pause:.1f}с до: {next_action}")
                 next_time = (datetime.now() + timedelta(seconds=next_pause)).strftime('%H:%M:%S')
                 print(f"⏰ Следующее действие в: {next_time}")
                     
                 self.print_separator(".", 60)
                 
                 # Прерываемый sleep с проверкой shutdown_event
-                if shutdown_event:
-                    try:
-                        await asyncio.wait_for(shutdown_event.wait(), timeout=next_pause)
+                remaining_pause = max(0, next_action_at - time.monotonic())
+                if shutdown_waiter:
+                    done, _ = await asyncio.wait({shutdown_waiter}, timeout=remaining_pause)
+                    if done:
                         print("\n🛑 Получен сигнал остановки во время паузы")
                         break
-                    except asyncio.TimeoutError:
-                        # Timeout означает что пауза закончилась и можно продолжать
-                        pass
+                    # Пауза закончилась без сигнала остановки - продолжаем
                 else:
-                    await asyncio.sleep(next_pause)
+                    await asyncio.sleep(remaining_pause)
                 
         except asyncio.CancelledError:
             print(f"\n\n🛑 Мониторинг отменен")
@@ -553,6 +767,19 @@ class WBSlotsMonitor:
             print(f"\n\n💥 КРИТИЧЕСКАЯ ОШИБКА: {str(e)}")
             print(f"📊 Выполнено циклов: {self.cycle_count}")
             print(f"🌐 Выполнено API запросов: {self.current_api_requests}")
+        finally:
+            if shutdown_waiter:
+                shutdown_waiter.cancel()
+            if self._telegram_worker_task is not None:
+                self._telegram_worker_task.cancel()
+                self._telegram_worker_task = None
+            if self._pending_parse is not None:
+                # Результат фонового парсинга отбрасываем: поток парсинга состояние монитора не трогает,
+                # а отмененная задача уже не применит его результат
+                self._pending_parse.cancel()
+                await asyncio.gather(self._pending_parse, return_exceptions=True)
+                self._pending_parse = None
+            await self.wb_monitor.close()
 
 
 async def main():
@@ -564,14 +791,21 @@ async def main():
                        help='Интервал обновления в секундах (по умолчанию: 300)')
     parser.add_argument('--once', action='store_true', 
                        help='Выполнить только один цикл мониторинга')
+    parser.add_argument('--sheet-cache-ttl', type=int, default=0,
+                       help='Сколько секунд переиспользовать парсинг неизмененной таблицы (по умолчанию: 0 - выключено)')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                       help='Не выводить подробный отчет по слотам, только сводку')
     
     args = parser.parse_args()
     
-    monitor = WBSlotsMonitor(update_interval=args.interval)
+    monitor = WBSlotsMonitor(update_interval=args.interval, sheet_cache_ttl=args.sheet_cache_ttl, quiet=args.quiet)
     
     if args.once:
         print("🔄 Выполнение одного оптимизированного цикла...")
-        result = await monitor.run_optimized_cycle()
+        try:
+            result = await monitor.run_optimized_cycle()
+        finally:
+            await monitor.wb_monitor.close()
         
         if result['success']:
             print(f"\n✅ Цикл завершен успешно за {result['total_time']:.2f}с")